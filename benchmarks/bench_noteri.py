@@ -0,0 +1,214 @@
+"""Headless benchmarks for the editor hot paths.
+
+Builds a synthetic vault, drives Noteri through Textual's test pilot and prints the
+timings as JSON, so runs of two versions can be compared:
+
+    python benchmarks/bench_noteri.py --files 2000 --output before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import noteri
+
+WORDS = ("note", "idea", "table", "list", "link", "draft", "vault", "editor", "text",
+         "search", "index", "render", "markdown", "preview", "cursor", "history")
+
+
+def make_vault(directory, files, depth, lines, links, seed):
+    """Write `files` markdown notes spread over `depth` levels, each linking to `links` others."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        parts = [f"dir{rng.randrange(4)}" for _ in range(rng.randrange(depth + 1))]
+        path = Path(directory, *parts, f"note{i}.md")
+        paths.append(path)
+
+    for path in paths:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        body = [f"# {path.stem}", ""]
+        for line in range(lines):
+            if line % 10 == 9:
+                body.append("")
+            body.append(" ".join(rng.choice(WORDS) for _ in range(12)))
+        for target in rng.sample(paths, min(links, len(paths))):
+            body.append(f"- [{target.stem}]({os.path.relpath(target, path.parent)})")
+        path.write_text("\n".join(body) + "\n")
+    return paths
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+async def wait_until(pilot, condition, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        await pilot.pause(0.001)
+
+
+async def run(args, vault, paths):
+    results = {}
+    key_times = []
+
+    # time spent handling each key inside the text area, without the render
+    on_key = noteri.ExtendedTextArea._on_key
+
+    def timed_on_key(self, event):
+        start = time.perf_counter()
+        try:
+            return on_key(self, event)
+        finally:
+            key_times.append(time.perf_counter() - start)
+
+    noteri.ExtendedTextArea._on_key = timed_on_key
+
+    app = noteri.Noteri(vault)
+    async with app.run_test(size=(160, 50)) as pilot:
+        await pilot.pause()
+        rng = random.Random(args.seed)
+
+        samples = []
+        for path in rng.sample(paths, min(args.repeat, len(paths))):
+            app.unsaved_changes = False
+            start = time.perf_counter()
+            app.open_file(path)
+            await wait_until(pilot, lambda: app.opening is None and app.filename == path)
+            samples.append(time.perf_counter() - start)
+        results["open_file"] = summary(samples)
+
+        app.backlink_index.ready = False
+        start = time.perf_counter()
+        await app.update_backlinks().wait()
+        results["update_backlinks_cold"] = summary([time.perf_counter() - start])
+
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            await app.update_backlinks().wait()
+            samples.append(time.perf_counter() - start)
+        results["update_backlinks"] = summary(samples)
+
+        await wait_until(pilot, lambda: not app.markdown_rendering)
+        samples = []
+        for _ in range(args.repeat):
+            await app.markdown.update("")
+            start = time.perf_counter()
+            await app._update_markdown()
+            samples.append(time.perf_counter() - start)
+        results["preview_render"] = summary(samples)
+
+        samples = []
+        for i in range(args.repeat):
+            app.ta.insert("word ", (2 + i, 0))
+            start = time.perf_counter()
+            await app._update_markdown()
+            samples.append(time.perf_counter() - start)
+        results["preview_refresh"] = summary(samples)
+
+        app.ta.focus()
+        app.ta.move_cursor((2, 0))
+        key_times.clear()
+        samples = []
+        for i in range(args.keys):
+            key = "enter" if i % 40 == 39 else rng.choice("abcdefghij ")
+            key = "space" if key == " " else key
+            start = time.perf_counter()
+            await pilot.press(key)
+            samples.append(time.perf_counter() - start)
+        results["keystroke_to_render"] = summary(samples)
+        results["text_area_on_key"] = summary(key_times)
+
+        await wait_until(pilot, app.file_index.ready.is_set)
+        app.path_search.sync(app.file_index)
+        provider = noteri.FileCommands(app.screen)
+        await provider.startup()
+        samples = []
+        for _ in range(args.repeat):
+            query = "".join(rng.choice("notedir0123456789") for _ in range(rng.randrange(1, 6)))
+            start = time.perf_counter()
+            async for _ in provider.search(query):
+                pass
+            samples.append(time.perf_counter() - start)
+        results["palette_search"] = summary(samples)
+
+        app.unsaved_changes = False
+
+    noteri.ExtendedTextArea._on_key = on_key
+    return results
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=500, help="Number of notes in the vault")
+    parser.add_argument("--depth", type=int, default=3, help="Maximum directory depth of the vault")
+    parser.add_argument("--lines", type=int, default=50, help="Lines of text per note")
+    parser.add_argument("--links", type=int, default=5, help="Links from each note to other notes")
+    parser.add_argument("--repeat", type=int, default=20, help="Samples for each measurement")
+    parser.add_argument("--keys", type=int, default=200, help="Keystrokes to type")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vault", help="Benchmark a copy of an existing directory instead of a synthetic vault")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="noteri-bench-")
+    if args.vault:
+        # benchmark a copy, so the app writes its caches and edits there, not into the vault
+        vault = os.path.join(directory, "vault")
+        shutil.copytree(args.vault, vault, ignore=shutil.ignore_patterns(noteri.CACHE_DIR))
+        paths = sorted(Path(vault).rglob("*.md"))
+    else:
+        vault = directory
+        paths = make_vault(vault, args.files, args.depth, args.lines, args.links, args.seed)
+
+    try:
+        results = asyncio.run(run(args, vault, paths))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "version": version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "vault": {"files": len(paths), "depth": args.depth, "lines": args.lines, "links": args.links, "seed": args.seed},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
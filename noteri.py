@@ -1,39 +1,1196 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 from markdown_it.token import Token
+import textual
 from textual.app import App, ComposeResult
-from textual.widgets import Markdown, TextArea, Markdown, DirectoryTree, Markdown, Label, Input, Switch, Button, Footer, MarkdownViewer, Tree
-from textual.widgets._markdown import MarkdownBlock
-from textual.widgets.text_area import LanguageDoesNotExist
+from textual.widgets import Markdown, TextArea, Markdown, DirectoryTree, Markdown, Label, Input, Switch, Button, Footer, MarkdownViewer, Tree, OptionList, Static
+from textual.widgets.option_list import Option
+from textual.widgets._directory_tree import DirEntry
+from textual.widgets._markdown import MarkdownBlock, HEADINGS, MarkdownHorizontalRule, MarkdownParagraph, MarkdownBlockQuote, MarkdownBulletList, MarkdownOrderedList, MarkdownOrderedListItem, MarkdownUnorderedListItem, MarkdownTable, MarkdownTBody, MarkdownTHead, MarkdownTR, MarkdownTH, MarkdownTD, MarkdownFence
+from textual.await_complete import AwaitComplete
+from markdown_it import MarkdownIt
+from textual.widgets.text_area import LanguageDoesNotExist, Edit, Selection
+from textual.document._document import EditResult, Document
+from textual.document._syntax_aware_document import SyntaxAwareDocument, SyntaxAwareDocumentError
+from textual.document._wrapped_document import WrappedDocument
+from textual.document._document_navigator import DocumentNavigator
 from textual.containers import Horizontal, ScrollableContainer, Vertical
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.geometry import Size
+from rich.segment import Segment
 from textual.screen import ModalScreen
-from textual.validation import Length
+from textual.validation import Length, Integer
 from textual.events import Event
 from textual import on
 from textual import work
+from textual.worker import get_current_worker
 from textual.binding import Binding
 from textual import events
 import re
-import pyperclip 
 import threading
 from functools import partial
 from pathlib import Path
 from textual.command import Hit, Hits, Provider
 import os
 import argparse
-from tree_sitter_languages import get_language
-import shutil
-import time
+import json
+import mmap
+import array
+import itertools
+import hashlib
+import collections
+import contextlib
+import sqlite3
+import subprocess
+import asyncio
+import bisect
+import math
+import heapq
+import ctypes
+import ctypes.util
+import select
+import struct
+import sys
 from textual._slug import TrackedSlugs
+from rich.text import Text
+from rich.style import Style
+
+
+IMPORT_TIME = time.perf_counter() - STARTUP_TIME
 
+# ExtendedTextArea swaps documents and highlights through private TextArea internals of this
+# release, and falls back to the public API (and no buffer cache) on any other
+TEXTUAL_VERSION = "0.48.2"
+PRIVATE_TEXT_AREA = textual.__version__ == TEXTUAL_VERSION
 
 SCM_PATH = "venv/lib/python3.11/site-packages/textual/tree-sitter/highlights/"
+CACHE_DIR = ".noteri"
+IGNORE_FILE = ".noteriignore"
+
+# tree-sitter grammars and highlight queries, loaded the first time a file needs them
+GRAMMARS = {}
+HIGHLIGHT_QUERIES = {}
 
 #TODO: File Exists new file check
 #TODO: 
 
+class IgnoreMatcher:
+    """Decides which paths under a directory are left out of the tree, the indexes and the watcher.
+
+    Patterns use .gitignore syntax and come from DEFAULTS, then the directory's .gitignore, then
+    its .noteriignore, later patterns overriding earlier ones. Paths are matched relative to the
+    directory with / separators. Walks never descend into an ignored directory.
+    """
+
+    DEFAULTS = (".*", "venv/", "node_modules/", "__pycache__/")
+    FILES = (".gitignore", IGNORE_FILE)
+
+    def __init__(self, directory):
+        self.root = os.path.abspath(directory)
+        lines = list(self.DEFAULTS)
+        for name in self.FILES:
+            try:
+                with open(os.path.join(self.root, name), "r") as f:
+                    lines.extend(f.read().splitlines())
+            except (OSError, UnicodeDecodeError):
+                pass
+        self.digest = hashlib.sha1("\n".join(lines).encode()).hexdigest()
+        self.rules = [rule for rule in map(self.compile, lines) if rule is not None]
+
+        # without negations every rule ignores, so one regex answers for all of them
+        self.file_re = self.dir_re = None
+        if not any(negate for negate, _, _ in self.rules):
+            self.file_re = self._join(regex for _, dir_only, regex in self.rules if not dir_only)
+            self.dir_re = self._join(regex for _, _, regex in self.rules)
+
+    @staticmethod
+    def _join(regexes):
+        patterns = [f"(?:{regex.pattern})" for regex in regexes]
+        return re.compile("|".join(patterns) if patterns else "(?!)")
+
+    @staticmethod
+    def compile(line:str):
+        """Translate one .gitignore line to (negate, directory only, regex), or None for blanks and comments."""
+        line = line.rstrip()
+        if not line or line[0] == "#":
+            return None
+        negate = line[0] == "!"
+        if negate or line[0] == "\\":
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+
+        # a pattern with a slash before its end is relative to the root, otherwise it matches at any depth
+        pattern = "" if "/" in line else "(?:.*/)?"
+        line = line.lstrip("/")
+        i = 0
+        while i < len(line):
+            if line.startswith("**/", i):
+                pattern += "(?:.*/)?"
+                i += 3
+            elif line.startswith("**", i):
+                pattern += ".*"
+                i += 2
+            elif line[i] == "*":
+                pattern += "[^/]*"
+                i += 1
+            elif line[i] == "?":
+                pattern += "[^/]"
+                i += 1
+            elif line[i] == "[" and line.find("]", i + 2) > 0:
+                end = line.find("]", i + 2)
+                body = line[i + 1:end]
+                if body[0] == "!":
+                    body = "^" + body[1:]
+                pattern += "[" + body.replace("\\", "\\\\") + "]"
+                i = end + 1
+            elif line[i] == "\\" and i + 1 < len(line):
+                pattern += re.escape(line[i + 1])
+                i += 2
+            else:
+                pattern += re.escape(line[i])
+                i += 1
+        return negate, dir_only, re.compile(pattern)
+
+    def relative(self, path) -> str:
+        """`path` relative to the root with / separators, "" for the root itself."""
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        return "" if relative == "." else relative.replace(os.sep, "/")
+
+    def prefix(self, path) -> str:
+        """What to put before the names of the entries of the directory `path` to match them."""
+        relative = self.relative(path)
+        return relative + "/" if relative else ""
+
+    def match(self, relative:str, is_dir:bool) -> bool:
+        """Whether the entry at `relative` is ignored, assuming the directories it is in are not."""
+        if self.dir_re is not None:
+            return (self.dir_re if is_dir else self.file_re).fullmatch(relative) is not None
+        ignored = False
+        for negate, dir_only, regex in self.rules:
+            if (is_dir or not dir_only) and regex.fullmatch(relative):
+                ignored = not negate
+        return ignored
+
+    def ignored(self, path, is_dir=None) -> bool:
+        """Whether `path`, or one of the directories it is in, is ignored."""
+        relative = self.relative(path)
+        if not relative:
+            return False
+        parts = relative.split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), True):
+                return True
+        if is_dir is None:
+            is_dir = os.path.isdir(path)
+        return self.match(relative, is_dir)
+
+class BacklinkIndex:
+    """Link graph of the markdown files in a directory, cached on disk and validated by mtime."""
+
+    VERSION = 1
+    LINK_RE = re.compile(r'\]\(([^)]+)\)')
+
+    def __init__(self, directory, ignore=None):
+        self.directory = Path(directory)
+        self.ignore = ignore if ignore is not None else IgnoreMatcher(directory)
+        self.cache_path = self.directory / CACHE_DIR / "backlinks.json"
+        self.lock = threading.Lock()
+        self.mtimes = {}
+        self.forward = {}
+        self.reverse = {}
+        self.ready = False
+        self.loaded = False
+        self.dirty = False
+
+    @staticmethod
+    def key(path) -> str:
+        return os.path.abspath(path)
+
+    def parse_links(self, source:str, text:str) -> set:
+        targets = set()
+        parent = Path(source).parent
+        for match in self.LINK_RE.finditer(text):
+            href = match.group(1).strip().strip("<>")
+            href = href.split("#")[0].replace("%20", " ")
+            if href == "" or "://" in href:
+                continue
+            targets.add(self.key(parent / href))
+        return targets
+
+    def _set_links(self, source, mtime, targets):
+        for target in self.forward.get(source, ()):
+            sources = self.reverse.get(target)
+            if sources is not None:
+                sources.discard(source)
+                if not sources:
+                    del self.reverse[target]
+
+        self.mtimes[source] = mtime
+        self.forward[source] = targets
+        for target in targets:
+            self.reverse.setdefault(target, set()).add(source)
+        self.dirty = True
+
+    def update_file(self, path, text=None):
+        source = self.key(path)
+        try:
+            mtime = os.stat(source).st_mtime
+            if text is None:
+                with open(source, "r") as f:
+                    text = f.read()
+        except (OSError, UnicodeDecodeError):
+            self.remove_file(path)
+            return
+
+        targets = self.parse_links(source, text)
+        with self.lock:
+            self._set_links(source, mtime, targets)
+
+    def remove_file(self, path):
+        """Drop a file, or every file under a directory, from the index."""
+        source = self.key(path)
+        prefix = source.rstrip(os.sep) + os.sep
+        with self.lock:
+            for key in [k for k in self.forward if k == source or k.startswith(prefix)]:
+                self._set_links(key, None, set())
+                del self.mtimes[key]
+                del self.forward[key]
+
+    def backlinks(self, path) -> list[Path]:
+        with self.lock:
+            sources = self.reverse.get(self.key(path), ())
+            return sorted(Path(source) for source in sources)
+
+    def _walk(self, path, prefix=""):
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+
+        for entry in entries:
+            is_dir = entry.is_dir()
+            if self.ignore.match(prefix + entry.name, is_dir):
+                continue
+            if is_dir:
+                yield from self._walk(entry.path, prefix + entry.name + "/")
+            elif entry.name.endswith(".md"):
+                yield entry
+
+    def iter_refresh(self):
+        """Re-read only the markdown files whose mtime changed, yielding each file's links as it goes."""
+        seen = set()
+        for entry in self._walk(self.directory):
+            source = self.key(entry.path)
+            seen.add(source)
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if self.mtimes.get(source) != mtime:
+                self.update_file(source)
+
+            with self.lock:
+                targets = self.forward.get(source, set())
+            yield source, targets
+
+        with self.lock:
+            removed = [k for k in self.forward if k not in seen]
+        for source in removed:
+            self.remove_file(source)
+
+        self.ready = True
+        self.save()
+
+    def refresh(self):
+        for _ in self.iter_refresh():
+            pass
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION:
+            return
+
+        with self.lock:
+            for source, entry in data.get("files", {}).items():
+                self._set_links(source, entry["mtime"], set(entry["links"]))
+            self.dirty = False
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {
+                "version": self.VERSION,
+                "files": {
+                    source: {"mtime": self.mtimes[source], "links": sorted(targets)}
+                    for source, targets in self.forward.items()
+                },
+            }
+            self.dirty = False
+
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            self.dirty = True
+
+class FileIndex:
+    """In-memory set of the files under a directory, kept current by a FileWatcher.
+
+    The listing of every directory is cached on disk along with the directory's mtime, so a
+    scan only lists directories whose entries changed since the last run.
+    """
+
+    MAX_DEPTH = 5
+    VERSION = 2
+
+    def __init__(self, directory, ignore=None):
+        self.directory = Path(directory)
+        self.ignore = ignore if ignore is not None else IgnoreMatcher(directory)
+        self.cache_path = self.directory / CACHE_DIR / "files.json"
+        self.lock = threading.Lock()
+        self.files = set()
+        self.listing = None
+        self.version = 0
+        self.ready = threading.Event()
+        self._snapshot = []
+        self._snapshot_version = -1
+
+    def _prefix(self, key:str) -> str:
+        prefix = os.path.normpath(os.path.join(self.directory, key))
+        return "" if prefix == "." else prefix + os.sep
+
+    def _scan_helper(self, path, depth=0, cached=None, listing=None):
+        if depth == self.MAX_DEPTH:
+            return
+        key = os.path.relpath(path, self.directory)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+
+        entry = cached.get(key) if cached is not None else None
+        if entry is None or entry["mtime"] != mtime:
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                return
+
+            entry = {"mtime": mtime, "files": [], "dirs": []}
+            prefix = "" if key == "." else key.replace(os.sep, "/") + "/"
+            for e in entries:
+                is_dir = e.is_dir()
+                if self.ignore.match(prefix + e.name, is_dir):
+                    continue
+                if is_dir:
+                    entry["dirs"].append(e.name)
+                elif e.is_file():
+                    entry["files"].append(e.name)
+
+        if listing is not None:
+            listing[key] = entry
+
+        prefix = self._prefix(key)
+        for name in entry["files"]:
+            yield prefix + name
+        for name in entry["dirs"]:
+            yield from self._scan_helper(os.path.join(path, name), depth+1, cached, listing)
+
+    def scan(self):
+        if self.listing is None:
+            self.load()
+        listing = {}
+        files = set(self._scan_helper(str(self.directory), cached=self.listing, listing=listing))
+        with self.lock:
+            self.files = files
+            self.listing = listing
+            self.version += 1
+        self.ready.set()
+        self.save()
+
+    def load(self):
+        """Fill the index from the on-disk cache, so it can be used before the scan finishes."""
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self.listing = {}
+            return
+        if data.get("version") != self.VERSION or data.get("ignore") != self.ignore.digest:
+            self.listing = {}
+            return
+
+        self.listing = data.get("directories", {})
+        files = set()
+        for key, entry in self.listing.items():
+            prefix = self._prefix(key)
+            files.update(prefix + name for name in entry["files"])
+        with self.lock:
+            self.files = files
+            self.version += 1
+        if files:
+            self.ready.set()
+
+    def save(self):
+        with self.lock:
+            data = {"version": self.VERSION, "ignore": self.ignore.digest, "directories": self.listing}
+
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass
+
+    def depth(self, path) -> int:
+        try:
+            return len(Path(path).relative_to(self.directory).parts) - 1
+        except ValueError:
+            return self.MAX_DEPTH
+
+    def add(self, path):
+        path = os.path.normpath(path)
+        if self.ignore.ignored(path):
+            return
+        if self.depth(path) >= self.MAX_DEPTH:
+            return
+
+        if os.path.isdir(path):
+            files = set(self._scan_helper(path, depth=self.depth(path) + 1))
+        else:
+            files = {path}
+        with self.lock:
+            self.files |= files
+            self.version += 1
+
+    def remove(self, path):
+        path = os.path.normpath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self.lock:
+            removed = {f for f in self.files if f == path or f.startswith(prefix)}
+            if removed:
+                self.files -= removed
+                self.version += 1
+
+    def snapshot(self) -> list[Path]:
+        with self.lock:
+            if self._snapshot_version != self.version:
+                self._snapshot = [Path(f) for f in sorted(self.files)]
+                self._snapshot_version = self.version
+            return self._snapshot
+
+class FileWatcher:
+    """Reports files created, deleted and modified under a directory.
+
+    Uses inotify where it is available and falls back to polling mtimes otherwise.
+    `callback` is called from the watching thread with ("created" | "deleted" | "modified", path)
+    or ("rescan", directory) when events were lost.
+    """
+
+    POLL_INTERVAL = 5
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, directory, callback, max_depth=FileIndex.MAX_DEPTH, ignore=None):
+        self.directory = Path(directory)
+        self.ignore = ignore if ignore is not None else IgnoreMatcher(directory)
+        self.callback = callback
+        self.max_depth = max_depth
+        self.watches = {}
+        self.libc = None
+        self.fd = None
+
+        if sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+                if fd >= 0:
+                    self.libc = libc
+                    self.fd = fd
+            except (OSError, AttributeError):
+                pass
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self.fd is not None
+
+    def _walk_dirs(self, path, depth=0, prefix=None):
+        if depth == self.max_depth:
+            return
+        if prefix is None:
+            prefix = self.ignore.prefix(path)
+        yield path, depth, prefix
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and not self.ignore.match(prefix + entry.name, True):
+                yield from self._walk_dirs(entry.path, depth+1, prefix + entry.name + "/")
+
+    def _add_watches(self, path, depth):
+        for directory, d, _ in self._walk_dirs(str(path), depth):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = (directory, d)
+
+    def run(self, cancelled, ready=None):
+        """Watch until `cancelled()` returns True, calling `ready()` once changes are being tracked."""
+        if self.uses_inotify:
+            self._run_inotify(cancelled, ready)
+        else:
+            self._run_polling(cancelled, ready)
+
+    def _run_inotify(self, cancelled, ready):
+        self._add_watches(self.directory, 0)
+        if ready is not None:
+            ready()
+        try:
+            while not cancelled():
+                readable, _, _ = select.select([self.fd], [], [], 0.5)
+                if not readable:
+                    continue
+                try:
+                    buffer = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._dispatch(buffer)
+        finally:
+            os.close(self.fd)
+
+    def _dispatch(self, buffer:bytes):
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _cookie, length = struct.unpack_from("iIII", buffer, offset)
+            name = buffer[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                self.callback("rescan", str(self.directory))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            directory, depth = self.watches[wd]
+            path = os.path.join(directory, os.fsdecode(name))
+            if self.ignore.match(self.ignore.relative(path), bool(mask & self.IN_ISDIR)):
+                continue
+
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                if mask & self.IN_ISDIR:
+                    self._add_watches(path, depth + 1)
+                self.callback("created", path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self.callback("deleted", path)
+            elif mask & self.IN_CLOSE_WRITE:
+                self.callback("modified", path)
+
+    def _poll(self) -> dict:
+        mtimes = {}
+        for directory, depth, prefix in self._walk_dirs(str(self.directory)):
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                    if not self.ignore.match(prefix + entry.name, is_dir):
+                        mtimes[entry.path] = (entry.stat().st_mtime, is_dir)
+                except OSError:
+                    pass
+        return mtimes
+
+    def _run_polling(self, cancelled, ready):
+        previous = self._poll()
+        if ready is not None:
+            ready()
+        last_poll = time.monotonic()
+        while not cancelled():
+            time.sleep(0.5)
+            if time.monotonic() - last_poll < self.POLL_INTERVAL:
+                continue
+
+            current = self._poll()
+            last_poll = time.monotonic()
+            for path in previous.keys() - current.keys():
+                self.callback("deleted", path)
+            for path, (mtime, is_dir) in current.items():
+                if path not in previous:
+                    self.callback("created", path)
+                elif not is_dir and previous[path][0] != mtime:
+                    self.callback("modified", path)
+            previous = current
+
+class FileWriter:
+    """Writes files from a background thread, atomically, coalescing repeated saves of a file.
+
+    `write` queues the text of a file, replacing any text still queued for it. `run` writes
+    the queue to a temporary file next to the target, fsyncs it and renames it over the target,
+    then calls the `done` callback of the write with (path, error) from the writing thread.
+    """
+
+    def __init__(self):
+        self.pending = {}
+        self.writing = None
+        self.condition = threading.Condition()
+
+    def write(self, path, text:str, done=None):
+        with self.condition:
+            self.pending[os.path.abspath(path)] = (text, done)
+            self.condition.notify_all()
+
+    def busy(self, path) -> bool:
+        path = os.path.abspath(path)
+        return path in self.pending or self.writing == path
+
+    def wait(self, path):
+        """Block until every queued write of `path` is on disk."""
+        with self.condition:
+            while self.busy(path):
+                self.condition.wait(0.5)
+
+    def _next(self, cancelled):
+        with self.condition:
+            while not self.pending:
+                if cancelled():
+                    return None
+                self.condition.wait(0.5)
+            path = next(iter(self.pending))
+            text, done = self.pending.pop(path)
+            self.writing = path
+            return path, text, done
+
+    def _write_next(self, item):
+        path, text, done = item
+        error = None
+        try:
+            self.write_atomic(path, text)
+        except OSError as e:
+            error = e
+        finally:
+            with self.condition:
+                self.writing = None
+                self.condition.notify_all()
+        if done is not None:
+            done(path, error)
+
+    def run(self, cancelled):
+        while True:
+            item = self._next(cancelled)
+            if item is None:
+                return
+            self._write_next(item)
+
+    def flush(self):
+        """Write everything still queued from the calling thread."""
+        with self.condition:
+            while self.writing is not None:
+                self.condition.wait(0.5)
+            items = [(path, text, None) for path, (text, done) in self.pending.items()]
+            self.pending.clear()
+        for item in items:
+            self._write_next(item)
+
+    @staticmethod
+    def write_atomic(path, text:str):
+        directory, name = os.path.split(path)
+        tmp = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                import shutil
+                shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+
+        # make the rename itself durable
+        with contextlib.suppress(OSError):
+            fd = os.open(directory or ".", os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+class PathSearchIndex:
+    """Fuzzy path search that narrows candidates with per-character postings before matching.
+
+    A query matches a path when its characters appear in the path in order, ignoring case,
+    which is the rule the command palette's matcher uses. Results of recent queries are kept
+    so that typing one more character only re-checks the previous matches.
+
+    Removed paths leave gaps and paths added later are out of length order, so the ids
+    are handed out again once those make up more than COMPACT_FRACTION of the index.
+    """
+
+    FULL_SCAN_LIMIT = 5000
+    CACHE_SIZE = 32
+    COMPACT_FRACTION = 0.25
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = -1
+        self.cache = {}
+        self.clear()
+
+    def clear(self):
+        self.paths = []
+        self.lower = []
+        self.ids = {}
+        self.postings = {}
+        self.stale = 0
+
+    def add(self, path:str):
+        if path in self.ids:
+            return
+        i = len(self.paths)
+        self.ids[path] = i
+        self.paths.append(path)
+        self.lower.append(path.lower())
+        for char in set(self.lower[i]):
+            self.postings.setdefault(char, set()).add(i)
+
+    def remove(self, path:str):
+        i = self.ids.pop(path, None)
+        if i is None:
+            return
+        for char in set(self.lower[i]):
+            self.postings[char].discard(i)
+        self.paths[i] = None
+        self.lower[i] = None
+
+    def sync(self, file_index:"FileIndex"):
+        """Apply the files added and removed from `file_index` since the last sync."""
+        with file_index.lock:
+            if file_index.version == self.version:
+                return
+            files = set(file_index.files)
+            version = file_index.version
+
+        with self.lock:
+            removed = self.ids.keys() - files
+            added = files - self.ids.keys()
+            self.stale += len(removed) + len(added)
+            if self.stale > len(files) * self.COMPACT_FRACTION:
+                self.clear()
+                added = files
+            for path in removed:
+                self.remove(path)
+            for path in sorted(added, key=len):
+                self.add(path)
+            self.version = version
+            self.cache.clear()
+
+    def _candidates(self, query:str):
+        for length in range(len(query) - 1, 0, -1):
+            cached = self.cache.get(query[:length])
+            if cached is not None:
+                return cached, True
+
+        chars = set(query) - {" "}
+        if not chars:
+            return [i for i, path in enumerate(self.paths) if path is not None], False
+        postings = sorted((self.postings.get(char, set()) for char in chars), key=len)
+        return set.intersection(*postings), False
+
+    def search(self, query:str, limit:int) -> list[str]:
+        """Return up to `limit` paths matching `query`, preferring substring matches and short paths."""
+        query = query.lower()
+        with self.lock:
+            lower = self.lower
+            if query == "":
+                return [path for path in self.paths if path is not None][:limit]
+
+            regex = re.compile(re.escape(query[0]) + "".join(f"[^{re.escape(char)}]*{re.escape(char)}" for char in query[1:]))
+            candidates, narrowed = self._candidates(query)
+
+            if narrowed:
+                matches = [i for i in candidates if lower[i] is not None and regex.search(lower[i])]
+            elif len(candidates) <= self.FULL_SCAN_LIMIT:
+                matches = sorted(i for i in candidates if lower[i] is not None and regex.search(lower[i]))
+            else:
+                # Too many candidates to check them all on a keystroke. Ids are handed out
+                # shortest path first, so walk them in order and stop once there are plenty.
+                matches = []
+                for i, path in enumerate(lower):
+                    if i in candidates and path is not None and regex.search(path):
+                        matches.append(i)
+                        if len(matches) >= limit * 4:
+                            break
+
+            if narrowed or len(candidates) <= self.FULL_SCAN_LIMIT:
+                if len(self.cache) >= self.CACHE_SIZE:
+                    self.cache.pop(next(iter(self.cache)))
+                self.cache[query] = matches
+
+            best = [i for i in matches if query in lower[i]][:limit]
+            if len(best) < limit:
+                chosen = set(best)
+                best += [i for i in matches if i not in chosen][:limit - len(best)]
+            return [self.paths[i] for i in best]
+
+class FullTextIndex:
+    """Positional inverted index over the text files in a directory, stored in an sqlite database.
+
+    Queries are whitespace separated terms that must all appear in a file. `"quoted words"`
+    must appear next to each other and `term*` matches any word starting with `term`.
+
+    Every (term, file) pair is one row holding the term's positions in the file as
+    delta encoded varints. Each file also keeps the position and the byte offset every
+    line starts at, so the line of a hit is found, and read, without reading the file.
+    Files are written to the database one transaction each as they are indexed.
+    """
+
+    VERSION = 2
+    MAX_FILE_SIZE = 2 * 1024 * 1024
+    TOKEN_RE = re.compile(r"\w+")
+    QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            mtime REAL NOT NULL,
+            lines BLOB NOT NULL,
+            offsets BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            file INTEGER NOT NULL,
+            positions BLOB NOT NULL,
+            PRIMARY KEY (term, file)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_file ON postings (file);
+    """
+
+    def __init__(self, directory, ignore=None):
+        self.directory = Path(directory)
+        self.ignore = ignore if ignore is not None else IgnoreMatcher(directory)
+        self.cache_path = self.directory / CACHE_DIR / "fulltext.db"
+        self.lock = threading.Lock()
+        self.db = None
+        self.ready = False
+
+    @staticmethod
+    def key(path) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def pack(values) -> bytes:
+        """Encode increasing integers as varints of the difference to the previous one."""
+        data = bytearray()
+        last = 0
+        for value in values:
+            delta = value - last
+            last = value
+            while delta >= 0x80:
+                data.append(delta & 0x7F | 0x80)
+                delta >>= 7
+            data.append(delta)
+        return bytes(data)
+
+    @staticmethod
+    def unpack(data:bytes) -> list[int]:
+        values = []
+        last = value = shift = 0
+        for byte in data:
+            value |= (byte & 0x7F) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                last += value
+                values.append(last)
+                value = shift = 0
+        return values
+
+    def tokenize(self, text:str):
+        """Return the term positions, and the position and byte offset each line starts at."""
+        positions = {}
+        line_starts = []
+        offsets = []
+        position = 0
+        offset = 0
+        for line in text.split("\n"):
+            line_starts.append(position)
+            offsets.append(offset)
+            offset += len(line.encode("utf-8", "surrogateescape")) + 1
+            for term in self.TOKEN_RE.findall(line.lower()):
+                positions.setdefault(term, []).append(position)
+                position += 1
+        return positions, line_starts, offsets
+
+    def _connect(self):
+        """The database, created the first time it is used. Call with the lock held."""
+        if self.db is not None:
+            return self.db
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.cache_path, check_same_thread=False, timeout=5)
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                db.executescript("DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS files;")
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self.SCHEMA)
+            db.execute(f"PRAGMA user_version={self.VERSION}")
+        except (OSError, sqlite3.Error):
+            # index in memory for this session
+            db = sqlite3.connect(":memory:", check_same_thread=False)
+            db.executescript(self.SCHEMA)
+        self.db = db
+        # the JSON index of earlier versions
+        with contextlib.suppress(OSError):
+            os.remove(self.directory / CACHE_DIR / "fulltext.json")
+        return db
+
+    def _delete(self, db, sources):
+        for (file,) in sources:
+            db.execute("DELETE FROM postings WHERE file = ?", (file,))
+            db.execute("DELETE FROM files WHERE id = ?", (file,))
+
+    def update_file(self, path, text=None):
+        source = self.key(path)
+        try:
+            stat = os.stat(source)
+            if text is None:
+                if stat.st_size > self.MAX_FILE_SIZE:
+                    raise OSError("too large to index")
+                with open(source, "rb") as f:
+                    text = f.read().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            self.remove_file(source, directory=False)
+            return
+
+        terms, lines, offsets = self.tokenize(text)
+        with self.lock:
+            try:
+                db = self._connect()
+                with db:
+                    self._delete(db, db.execute("SELECT id FROM files WHERE path = ?", (source,)).fetchall())
+                    file = db.execute("INSERT INTO files (path, mtime, lines, offsets) VALUES (?, ?, ?, ?)",
+                                      (source, stat.st_mtime, self.pack(lines), self.pack(offsets))).lastrowid
+                    db.executemany("INSERT INTO postings (term, file, positions) VALUES (?, ?, ?)",
+                                   ((term, file, self.pack(found)) for term, found in terms.items()))
+            except sqlite3.Error:
+                pass
+
+    def remove_file(self, path, directory=True):
+        source = self.key(path)
+        prefix = source.rstrip(os.sep) + os.sep
+        with self.lock:
+            try:
+                db = self._connect()
+                with db:
+                    files = db.execute("SELECT id FROM files WHERE path = ?", (source,)).fetchall()
+                    if directory:
+                        files += db.execute("SELECT id FROM files WHERE path >= ? AND path < ?",
+                                            (prefix, prefix + "\U0010ffff")).fetchall()
+                    self._delete(db, files)
+            except sqlite3.Error:
+                pass
+
+    def _walk(self, path, prefix=""):
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+
+        for entry in entries:
+            is_dir = entry.is_dir()
+            if self.ignore.match(prefix + entry.name, is_dir):
+                continue
+            if is_dir:
+                yield from self._walk(entry.path, prefix + entry.name + "/")
+            elif entry.is_file():
+                yield entry
+
+    def refresh(self, cancelled=lambda: False):
+        """Re-read only the files whose mtime changed since they were indexed."""
+        with self.lock:
+            try:
+                indexed = dict(self._connect().execute("SELECT path, mtime FROM files"))
+            except sqlite3.Error:
+                indexed = {}
+
+        for entry in self._walk(self.directory):
+            if cancelled():
+                return
+            source = self.key(entry.path)
+            mtime = indexed.pop(source, None)
+            try:
+                if entry.stat().st_mtime == mtime:
+                    continue
+            except OSError:
+                continue
+            self.update_file(source)
+
+        for source in indexed:
+            self.remove_file(source, directory=False)
+        self.ready = True
+
+    def load(self):
+        with self.lock:
+            self._connect()
+
+    def save(self):
+        """Close the database. Every file is committed as soon as it is indexed."""
+        with self.lock:
+            if self.db is not None:
+                with contextlib.suppress(sqlite3.Error):
+                    self.db.close()
+                self.db = None
+
+    def _expand(self, db, term:str) -> list[str]:
+        if not term.endswith("*"):
+            return [term]
+        prefix = term[:-1]
+        rows = db.execute("SELECT DISTINCT term FROM postings WHERE term >= ? AND term < ?", (prefix, prefix + "\U0010ffff"))
+        return [term for (term,) in rows]
+
+    def _postings(self, db, term:str, cache:dict) -> dict:
+        """{file: encoded positions} of every file containing `term`."""
+        if term not in cache:
+            cache[term] = dict(db.execute("SELECT file, positions FROM postings WHERE term = ?", (term,)))
+        return cache[term]
+
+    def _phrase_positions(self, postings, file, phrase) -> list[int]:
+        """Return the positions in `file` where every term of `phrase` follows the previous one."""
+        positions = set(self.unpack(postings[phrase[0]][file]))
+        for offset, term in enumerate(phrase[1:], start=1):
+            positions &= {p - offset for p in self.unpack(postings[term][file])}
+            if not positions:
+                break
+        return sorted(positions)
+
+    def search(self, query:str, limit:int=100) -> list[tuple]:
+        """Return `(path, line, score)` for the best matching files and the line of their first hit."""
+        clauses = []
+        for phrase, word in self.QUERY_RE.findall(query.lower()):
+            if phrase:
+                terms = self.TOKEN_RE.findall(phrase)
+                if terms:
+                    clauses.append(("phrase", terms))
+            elif word.endswith("*"):
+                stem = "".join(self.TOKEN_RE.findall(word[:-1]))
+                if stem:
+                    clauses.append(("prefix", stem + "*"))
+            else:
+                clauses.extend(("term", term) for term in self.TOKEN_RE.findall(word))
+        if not clauses:
+            return []
+
+        with self.lock:
+            try:
+                return self._search(self._connect(), clauses, limit)
+            except sqlite3.Error:
+                return []
+
+    def _search(self, db, clauses, limit:int) -> list[tuple]:
+        total = max(db.execute("SELECT count(*) FROM files").fetchone()[0], 1)
+        postings = {}
+        candidates = None
+        expanded = []
+        for kind, value in clauses:
+            terms = value if kind == "phrase" else self._expand(db, value)
+            files = set()
+            if kind == "phrase":
+                files = set.intersection(*(set(self._postings(db, t, postings)) for t in terms))
+            else:
+                for term in terms:
+                    files |= self._postings(db, term, postings).keys()
+            candidates = files if candidates is None else candidates & files
+            expanded.append((kind, terms))
+            if not candidates:
+                return []
+
+        scored = []
+        for file in candidates:
+            score = 0.0
+            first = None
+            for kind, terms in expanded:
+                if kind == "phrase":
+                    positions = self._phrase_positions(postings, file, terms)
+                    if not positions:
+                        break
+                    weight = len(terms) * math.log(1 + total / len(postings[terms[0]]))
+                else:
+                    positions = []
+                    weight = 0.0
+                    for term in terms:
+                        found = postings[term].get(file)
+                        if found is not None:
+                            positions.extend(self.unpack(found))
+                            weight = max(weight, math.log(1 + total / len(postings[term])))
+                score += (1 + math.log(len(positions))) * weight
+                first = min(positions) if first is None else min(first, min(positions))
+            else:
+                scored.append((score, file, first))
+
+        results = []
+        for score, file, first in heapq.nsmallest(limit, scored, key=lambda result: -result[0]):
+            source, lines = db.execute("SELECT path, lines FROM files WHERE id = ?", (file,)).fetchone()
+            line = bisect.bisect_right(self.unpack(lines), first) - 1
+            results.append((source, line, score))
+        results.sort(key=lambda result: (-result[2], result[0]))
+        return results
+
+    def line(self, source:str, line:int) -> str:
+        """The text of `line` in `source`, read from the offset it was indexed at."""
+        with self.lock:
+            try:
+                row = self._connect().execute("SELECT offsets FROM files WHERE path = ?", (source,)).fetchone()
+            except sqlite3.Error:
+                row = None
+        if row is None:
+            return ""
+        offsets = self.unpack(row[0])
+        if not 0 <= line < len(offsets):
+            return ""
+        try:
+            with open(source, "rb") as f:
+                f.seek(offsets[line])
+                return f.readline().decode("utf-8", "replace").rstrip("\r\n")
+        except OSError:
+            return ""
+
 class WidgetCommands(Provider):
 
     async def startup(self) -> None:  
-        self.widgets = ["DirectoryTree", "#markdown", "TextArea", "#footer"]
+        self.widgets = ["DirectoryTree", "#markdown", "TextArea", "#footer", "#timings"]
 
     async def search(self, query: str) -> Hits:  
         matcher = self.matcher(query)  
@@ -53,32 +1210,25 @@ class WidgetCommands(Provider):
 
 class FileCommands(Provider):
 
-    def _read_files_helper(self, path, depth = 0):
-        file_list = []    
-        if depth == 5:
-            return []
-        
-        l = list(Path(path).glob("*"))
-
-        for p in l:
-            if p.name[0] == "." or p.name[0] == "venv":
-                continue
-            if p.is_dir():
-                for item in self._read_files_helper(p, depth=depth+1):
-                    file_list.append(item)
-            elif p.is_file():
-                file_list.append(p)
-        return file_list
-
-
-    def read_files(self) -> list[Path]:
-        return self._read_files_helper(Path(self.app.directory))
-        #return list(Path(self.app.directory).glob("*.*"))
+    MAX_FILE_HITS = 50
 
     async def startup(self) -> None:  
         """Called once when the command palette is opened, prior to searching."""
-        worker = self.app.run_worker(self.read_files, thread=True)
-        self.file_paths = await worker.wait()
+        app = self.app
+        if not app.file_index.ready.is_set():
+            worker = app.run_worker(app.file_index.ready.wait, thread=True)
+            await worker.wait()
+        worker = app.run_worker(partial(app.path_search.sync, app.file_index), thread=True)
+        await worker.wait()
+
+    @staticmethod
+    def _split_command(command:str, query:str) -> int:
+        """Return how many leading characters of `query` are matched by `command`."""
+        consumed = 0
+        for char in command.lower() + " ":
+            if consumed < len(query) and query[consumed].lower() == char:
+                consumed += 1
+        return consumed
 
     async def search(self, query: str) -> Hits:  
         """Search for files."""
@@ -93,18 +1243,25 @@ class FileCommands(Provider):
 
         # Open File
         for command, action in commands.items():
-            for path in self.file_paths:
-                full_command = f"{command} {str(path)}"
+            consumed = self._split_command(command, query)
+            paths = app.path_search.search(query[consumed:], self.MAX_FILE_HITS)
+            if consumed > 0:
+                paths += app.path_search.search(query, self.MAX_FILE_HITS)
+
+            scored = []
+            for path in dict.fromkeys(paths):
+                full_command = f"{command} {path}"
                 score = matcher.match(full_command)
-
-                # Open File
                 if score > 0:
-                    yield Hit(
-                        score,
-                        matcher.highlight(full_command),  
-                        partial(action, path),
-                        #help="Open this file in the viewer",
-                    )
+                    scored.append((score, full_command, path))
+
+            for score, full_command, path in heapq.nlargest(self.MAX_FILE_HITS, scored):
+                yield Hit(
+                    score,
+                    matcher.highlight(full_command),  
+                    partial(action, Path(path)),
+                    #help="Open this file in the viewer",
+                )
                 
 
         # Define a map of commands and their respective actions
@@ -115,6 +1272,11 @@ class FileCommands(Provider):
             "Rename": partial(app.action_rename),
             "Delete": partial(app.action_delete),
             "Find": partial(app.action_find),
+            "Find Next": partial(app.action_find_next),
+            "Go to Line": partial(app.action_goto_line),
+            "Find Previous": partial(app.action_find_previous),
+            "Replace": partial(app.action_find),
+            "Search in Vault": partial(app.action_search_vault),
             "New Directory": partial(app.action_new_directory),
             "Cut": partial(app.action_cut),
             "Copy": partial(app.action_copy),
@@ -251,6 +1413,1735 @@ class FileSelectionPopup(ModalScreen):
         self.app.post_message(Noteri.FileSystemCallback(self.callback, self.selected_file))
         self.app.pop_screen()
     
+class VaultSearchPopup(ModalScreen):
+    BINDINGS = [ ("escape", "pop_screen") ]
+
+    MAX_RESULTS = 100
+
+    def __init__(self, callback, index:FullTextIndex, directory) -> None:
+        super().__init__()
+        self.callback = callback
+        self.index = index
+        self.directory = directory
+        self.results = []
+
+    def compose(self) -> ComposeResult:
+        yield Label("Search in Vault")
+        yield Input(placeholder='words, "a phrase", prefix*')
+        yield OptionList(id="vault_results")
+
+    @on(Input.Changed)
+    def query_changed(self, event:Input.Changed):
+        self.search(event.value)
+
+    @on(Input.Submitted)
+    def submitted(self, event:Input.Submitted):
+        self.query_one(OptionList).focus()
+
+    @work(thread=True, exclusive=True)
+    def search(self, query):
+        results = self.index.search(query, self.MAX_RESULTS)
+
+        options = []
+        for source, line, score in results:
+            context = self.index.line(source, line).strip()
+            try:
+                name = os.path.relpath(source, self.directory)
+            except ValueError:
+                name = source
+            prompt = Text.assemble((f"{name}:{line + 1}", "bold"), "  ", context[:120])
+            options.append(Option(prompt))
+
+        self.app.call_from_thread(self.show_results, results, options)
+
+    def show_results(self, results, options):
+        self.results = results
+        option_list = self.query_one(OptionList)
+        option_list.clear_options()
+        option_list.add_options(options)
+
+    @on(OptionList.OptionSelected)
+    def result_selected(self, event:OptionList.OptionSelected):
+        source, line, score = self.results[event.option_index]
+        self.app.post_message(Noteri.FileSystemCallback(self.callback, (Path(source), line)))
+        self.app.pop_screen()
+
+class FindPopup(ModalScreen):
+    BINDINGS = [ ("escape", "pop_screen") ]
+
+    def __init__(self, query="", replacement="", regex=False, case_sensitive=False) -> None:
+        super().__init__()
+        self.find_query = query
+        self.replacement = replacement
+        self.regex = regex
+        self.case_sensitive = case_sensitive
+
+    def compose(self) -> ComposeResult:
+        yield Label("Find")
+        yield Input(value=self.find_query, placeholder="Find", id="find_query")
+        yield Input(value=self.replacement, placeholder="Replace", id="find_replacement")
+        with Horizontal():
+            yield Label("Regex")
+            yield Switch(value=self.regex, id="find_regex")
+            yield Label("Match Case")
+            yield Switch(value=self.case_sensitive, id="find_case")
+        yield Label("", id="find_count")
+        with Horizontal():
+            yield Button("Previous", id="find_previous")
+            yield Button("Next", id="find_next")
+            yield Button("Replace", id="find_replace")
+            yield Button("Replace All", id="find_replace_all", variant="warning")
+
+    def on_mount(self):
+        self.query_changed()
+
+    @on(Input.Changed, "#find_query")
+    @on(Switch.Changed)
+    def query_changed(self, event=None):
+        query = self.query_one("#find_query", expect_type=Input).value
+        regex = self.query_one("#find_regex", expect_type=Switch).value
+        case_sensitive = self.query_one("#find_case", expect_type=Switch).value
+        self.update_count(self.app.set_find(query, regex, case_sensitive))
+
+    @on(Input.Changed, "#find_replacement")
+    def replacement_changed(self, event:Input.Changed):
+        self.app.last_replace = event.value
+
+    def update_count(self, message):
+        self.query_one("#find_count", expect_type=Label).update(message)
+
+    @on(Input.Submitted, "#find_query")
+    def submitted(self, event:Input.Submitted):
+        self.app.pop_screen()
+        self.app.find_next()
+
+    @on(Button.Pressed, "#find_next")
+    def next(self, event:Button.Pressed):
+        self.update_count(self.app.find_next())
+
+    @on(Button.Pressed, "#find_previous")
+    def previous(self, event:Button.Pressed):
+        self.update_count(self.app.find_next(forward=False))
+
+    @on(Button.Pressed, "#find_replace")
+    def replace(self, event:Button.Pressed):
+        self.update_count(self.app.replace_next(self.query_one("#find_replacement", expect_type=Input).value))
+
+    @on(Button.Pressed, "#find_replace_all")
+    def replace_all(self, event:Button.Pressed):
+        self.update_count(self.app.replace_all(self.query_one("#find_replacement", expect_type=Input).value))
+
+class TokenCache:
+    """Parsed markdown by content hash, evicting the least recently used past `max_bytes`.
+
+    An entry holds the top level token groups of a document, their keys and, once asked for,
+    its table of contents. Entry sizes are estimated from the length of the source.
+    """
+
+    TOKEN_OVERHEAD = 8
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def digest(text:str) -> bytes:
+        return hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+
+    def get(self, digest:bytes):
+        """[size, groups, keys, table of contents] for `digest`, or None."""
+        entry = self.entries.get(digest)
+        if entry is not None:
+            self.entries.move_to_end(digest)
+        return entry
+
+    def put(self, digest:bytes, length:int, groups, keys) -> list:
+        entry = [length * self.TOKEN_OVERHEAD, groups, keys, None]
+        self.restore(digest, entry)
+        return entry
+
+    def restore(self, digest:bytes, entry:list):
+        """Keep `entry` for `digest` again, if it was evicted since it was cached."""
+        if entry[0] > self.max_bytes:
+            return
+        previous = self.entries.pop(digest, None)
+        if previous is not None:
+            self.size -= previous[0]
+        self.entries[digest] = entry
+        self.size += entry[0]
+        while self.size > self.max_bytes:
+            _, oldest = self.entries.popitem(last=False)
+            self.size -= oldest[0]
+
+MARKDOWN_TOKENS = TokenCache()
+
+class IncrementalMarkdown(Markdown):
+    """A Markdown widget that only rebuilds the top level blocks whose tokens changed.
+
+    The token stream is split into top level groups (a paragraph, a list, a table, ...). On
+    update, the groups shared with the previous document at the start and at the end are kept
+    mounted and only the widgets of the groups in between are replaced.
+
+    Blocks are built with the private internals of Markdown.update, so the Textual version is
+    pinned in requirements.txt and setup.py.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._group_keys = []
+        self._group_blocks = []
+        self._group_contents = []
+        self._next_block_id = 0
+        self._update_lock = asyncio.Lock()
+        self._digest = None
+
+    def _parse(self, markdown:str) -> list[Token]:
+        parser = MarkdownIt("gfm-like") if self._parser_factory is None else self._parser_factory()
+        return parser.parse(markdown)
+
+    def _tokens(self, markdown:str, digest:bytes) -> list:
+        """The cache entry of `markdown`, parsing it only if it is not cached."""
+        entry = MARKDOWN_TOKENS.get(digest)
+        if entry is None:
+            groups = self._split_groups(self._parse(markdown))
+            entry = MARKDOWN_TOKENS.put(digest, len(markdown), groups, [self._group_key(group) for group in groups])
+        return entry
+
+    def table_of_contents(self, markdown:str) -> list[tuple]:
+        """(level, title, None) for every heading of `markdown`, without rendering it."""
+        entry = self._tokens(markdown, MARKDOWN_TOKENS.digest(markdown))
+        if entry[3] is None:
+            headings = []
+            tokens = [token for group in entry[1] for token in group]
+            for token, inline in zip(tokens, tokens[1:]):
+                if token.type == "heading_open":
+                    title = "".join(child.content if child.type in ("text", "code_inline") else " "
+                                    for child in inline.children or () if child.type in ("text", "code_inline", "softbreak"))
+                    headings.append((int(token.tag[1:]), title, None))
+            entry[3] = headings
+        return entry[3]
+
+    @staticmethod
+    def _split_groups(tokens:list[Token]) -> list[list[Token]]:
+        groups = []
+        current = []
+        for token in tokens:
+            current.append(token)
+            if token.level == 0 and token.nesting <= 0:
+                groups.append(current)
+                current = []
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _group_key(group:list[Token]) -> tuple:
+        # Source line numbers (token.map) are left out so that an edit above a block
+        # does not invalidate it.
+        return tuple(
+            (token.type, token.tag, token.info, token.markup, token.content, tuple(sorted(token.attrs.items())))
+            for token in group
+        )
+
+    def _inline_content(self, token:Token) -> Text:
+        style_stack = [Style()]
+        content = Text()
+        for child in token.children or ():
+            if child.type == "text":
+                content.append(child.content, style_stack[-1])
+            if child.type == "hardbreak":
+                content.append("\n")
+            if child.type == "softbreak":
+                content.append(" ", style_stack[-1])
+            elif child.type == "code_inline":
+                content.append(child.content, style_stack[-1] + self.get_component_rich_style("code_inline", partial=True))
+            elif child.type in ("em_open", "strong_open", "s_open"):
+                component = child.type[:-len("_open")]
+                style_stack.append(style_stack[-1] + self.get_component_rich_style(component, partial=True))
+            elif child.type == "link_open":
+                href = child.attrs.get("href", "")
+                style_stack.append(style_stack[-1] + Style.from_meta({"@click": f"link({href!r})"}))
+            elif child.type == "image":
+                href = child.attrs.get("src", "")
+                alt = child.attrs.get("alt", "")
+                style = style_stack[-1] + Style.from_meta({"@click": f"link({href!r})"})
+                content.append("🖼  ", style)
+                if alt:
+                    content.append(f"({alt})", style)
+                for grandchild in child.children or ():
+                    content.append(grandchild.content, style)
+            elif child.type.endswith("_close"):
+                style_stack.pop()
+        return content
+
+    def _build_group(self, group:list[Token]):
+        """Build the widgets and table of contents entries for one top level group."""
+        output = []
+        stack = []
+        table_of_contents = []
+
+        for token in group:
+            if token.type == "heading_open":
+                self._next_block_id += 1
+                stack.append(HEADINGS[token.tag](self, id=f"block{self._next_block_id}"))
+            elif token.type == "hr":
+                output.append(MarkdownHorizontalRule(self))
+            elif token.type == "paragraph_open":
+                stack.append(MarkdownParagraph(self))
+            elif token.type == "blockquote_open":
+                stack.append(MarkdownBlockQuote(self))
+            elif token.type == "bullet_list_open":
+                stack.append(MarkdownBulletList(self))
+            elif token.type == "ordered_list_open":
+                stack.append(MarkdownOrderedList(self))
+            elif token.type == "list_item_open":
+                if token.info:
+                    stack.append(MarkdownOrderedListItem(self, token.info))
+                else:
+                    item_count = sum(1 for block in stack if isinstance(block, MarkdownUnorderedListItem))
+                    stack.append(MarkdownUnorderedListItem(self, self.BULLETS[item_count % len(self.BULLETS)]))
+            elif token.type == "table_open":
+                stack.append(MarkdownTable(self))
+            elif token.type == "tbody_open":
+                stack.append(MarkdownTBody(self))
+            elif token.type == "thead_open":
+                stack.append(MarkdownTHead(self))
+            elif token.type == "tr_open":
+                stack.append(MarkdownTR(self))
+            elif token.type == "th_open":
+                stack.append(MarkdownTH(self))
+            elif token.type == "td_open":
+                stack.append(MarkdownTD(self))
+            elif token.type.endswith("_close"):
+                block = stack.pop()
+                if token.type == "heading_close":
+                    table_of_contents.append((int(token.tag[1:]), block._text.plain, block.id))
+                if stack:
+                    stack[-1]._blocks.append(block)
+                else:
+                    output.append(block)
+            elif token.type == "inline":
+                stack[-1].set_content(self._inline_content(token))
+            elif token.type in ("fence", "code_block"):
+                (stack[-1]._blocks if stack else output).append(MarkdownFence(self, token.content.rstrip(), token.info))
+            else:
+                external = self.unhandled_token(token)
+                if external is not None:
+                    (stack[-1]._blocks if stack else output).append(external)
+
+        return output, table_of_contents
+
+    def update(self, markdown:str) -> AwaitComplete:
+        """Update the document, rebuilding only the top level blocks that changed."""
+        digest = MARKDOWN_TOKENS.digest(markdown)
+        if digest == self._digest:
+            return AwaitComplete.nothing()
+        _, groups, keys, _ = self._tokens(markdown, digest)
+        self._digest = digest
+        old_keys = self._group_keys
+
+        start = 0
+        while start < min(len(old_keys), len(keys)) and old_keys[start] == keys[start]:
+            start += 1
+        old_end, new_end = len(old_keys), len(keys)
+        while old_end > start and new_end > start and old_keys[old_end - 1] == keys[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+
+        built = [self._build_group(group) for group in groups[start:new_end]]
+        removed = [block for blocks in self._group_blocks[start:old_end] for block in blocks]
+        before = next((blocks[0] for blocks in self._group_blocks[old_end:] if blocks), None)
+        clear = not self._group_keys
+
+        self._group_keys = keys
+        self._group_blocks[start:old_end] = [blocks for blocks, _ in built]
+        self._group_contents[start:old_end] = [contents for _, contents in built]
+        self._table_of_contents = [entry for contents in self._group_contents for entry in contents]
+
+        self.post_message(Markdown.TableOfContentsUpdated(self, self._table_of_contents))
+        output = [block for blocks, _ in built for block in blocks]
+
+        async def await_update() -> None:
+            async with self._update_lock:
+                with self.app.batch_update():
+                    if clear:
+                        await self.query("MarkdownBlock").remove()
+                    else:
+                        for block in removed:
+                            await block.remove()
+                    if output:
+                        await self.mount_all(output, before=before)
+
+        return AwaitComplete(await_update())
+
+class HistoryEdit:
+    """One replacement of `replaced` by `text`, starting at `top` and ending at `end` afterwards."""
+
+    __slots__ = ("top", "end", "text", "replaced", "replaced_end")
+
+    def __init__(self, top, end, text, replaced, replaced_end):
+        self.top = top
+        self.end = end
+        self.text = text
+        self.replaced = replaced
+        self.replaced_end = replaced_end
+
+    @property
+    def size(self) -> int:
+        return len(self.text) + len(self.replaced)
+
+class HistoryTransaction:
+    """Edits undone and redone together, with the selection to restore on undo."""
+
+    __slots__ = ("edits", "selection", "size", "journaled")
+
+    def __init__(self, selection):
+        self.edits = []
+        self.selection = selection
+        self.size = 0
+        self.journaled = False
+
+class EditHistory:
+    """Undo/redo log of edit deltas, grouped into transactions and bounded by depth and memory.
+
+    Typing and deleting at the cursor is merged into a single edit while it stays contiguous
+    and no longer than TRANSACTION_TIMEOUT apart, so undo works on runs of typing.
+    """
+
+    TRANSACTION_TIMEOUT = 1.0
+
+    def __init__(self, max_depth=1000, max_bytes=32 * 1024 * 1024):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+        self.size = 0
+        self.last_edit_time = 0.0
+        self.open = False
+        self.group_depth = 0
+
+        # Bookkeeping for the UndoJournal of the file being edited.
+        self.loader = None
+        self.journal_path = None
+        self.journal_pops = 0
+        self.journal_reset = True
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.size = 0
+        self.open = False
+        self.loader = None
+        self.journal_path = None
+        self.journal_pops = 0
+        self.journal_reset = True
+
+    def prepend(self, transactions):
+        """Put older transactions, oldest first, underneath the ones already in the history."""
+        for transaction in reversed(transactions):
+            if len(self.undo_stack) >= self.max_depth or self.size + transaction.size > self.max_bytes:
+                break
+            self.undo_stack.appendleft(transaction)
+            self.size += transaction.size
+
+    def checkpoint(self):
+        """Make the next edit start a new transaction."""
+        self.open = False
+
+    @contextlib.contextmanager
+    def group(self, join=False):
+        """Record every edit made inside the block as one transaction, or with `join` as part of the open one."""
+        if self.group_depth == 0 and (not join or time.monotonic() - self.last_edit_time > self.TRANSACTION_TIMEOUT):
+            self.open = False
+        self.group_depth += 1
+        try:
+            yield
+        finally:
+            self.group_depth -= 1
+            if self.group_depth == 0 and not join:
+                self.open = False
+
+    def _merge(self, last:HistoryEdit, edit:HistoryEdit) -> bool:
+        if "\n" in edit.text:
+            return False
+        if last.replaced == "" and edit.replaced == "" and edit.top == last.end:
+            last.text += edit.text
+            last.end = edit.end
+            return True
+        if last.text == "" and edit.text == "" and "\n" not in edit.replaced:
+            # Backspace, then delete.
+            if edit.replaced_end == last.top:
+                last.replaced = edit.replaced + last.replaced
+                last.top = last.end = edit.top
+                return True
+            if edit.top == last.top:
+                last.replaced += edit.replaced
+                last.replaced_end = (last.replaced_end[0], last.replaced_end[1] + len(edit.replaced))
+                return True
+        return False
+
+    def record(self, edit:HistoryEdit, selection):
+        now = time.monotonic()
+        grouped = self.group_depth > 0
+        if not grouped and now - self.last_edit_time > self.TRANSACTION_TIMEOUT:
+            self.open = False
+        self.last_edit_time = now
+        self.redo_stack.clear()
+
+        transaction = self.undo_stack[-1] if self.open and self.undo_stack else None
+        if transaction is not None and transaction.edits:
+            last = transaction.edits[-1]
+            if self._merge(last, edit):
+                self._resize(transaction, edit.size)
+                return
+            if not grouped:
+                transaction = None
+
+        if transaction is None:
+            transaction = HistoryTransaction(selection)
+            self.undo_stack.append(transaction)
+            self.open = True
+        transaction.edits.append(edit)
+        self._resize(transaction, edit.size)
+
+    def _resize(self, transaction, size):
+        transaction.size += size
+        self.size += size
+        while len(self.undo_stack) > 1 and (len(self.undo_stack) > self.max_depth or self.size > self.max_bytes):
+            evicted = self.undo_stack.popleft()
+            self.size -= evicted.size
+            # Older history can no longer be joined onto what is left.
+            self.loader = None
+            if not evicted.journaled:
+                self.journal_reset = True
+
+    def pop_undo(self):
+        self.open = False
+        if not self.undo_stack and self.loader is not None:
+            loader, self.loader = self.loader, None
+            loader(self)
+        if not self.undo_stack:
+            return None
+        transaction = self.undo_stack.pop()
+        self.size -= transaction.size
+        self.redo_stack.append(transaction)
+        if transaction.journaled:
+            self.journal_pops += 1
+        return transaction
+
+    def pop_redo(self):
+        self.open = False
+        if not self.redo_stack:
+            return None
+        transaction = self.redo_stack.pop()
+        self.undo_stack.append(transaction)
+        self.size += transaction.size
+        if transaction.journaled:
+            self.journal_pops -= 1
+        return transaction
+
+class UndoJournal:
+    """Append-only, per-file journal of undo transactions, kept under the cache directory.
+
+    Each line is a JSON record: {"t": transaction} pushes a transaction, {"p": n} pops the
+    last n, {"h": hash} marks the content hash of the file after a save and {"r": 1} starts
+    over. A file's history is only restored when its content hash matches the last mark, and
+    then only as many transactions as the history holds are read, from the end of the journal.
+    """
+
+    MAX_SIZE = 4 * 1024 * 1024
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, directory):
+        self.directory = Path(directory) / CACHE_DIR / "undo"
+
+    @staticmethod
+    def content_hash(text:str) -> str:
+        return hashlib.sha1(text.encode("utf-8", "surrogateescape")).hexdigest()
+
+    def journal_path(self, path) -> Path:
+        name = hashlib.sha1(os.path.abspath(path).encode("utf-8", "surrogateescape")).hexdigest()
+        return self.directory / f"{name}.jsonl"
+
+    @staticmethod
+    def _encode(transaction:HistoryTransaction) -> dict:
+        return {
+            "s": list(transaction.selection),
+            "e": [[e.top, e.end, e.text, e.replaced, e.replaced_end] for e in transaction.edits],
+        }
+
+    @staticmethod
+    def _decode(data:dict) -> HistoryTransaction:
+        start, end = data["s"]
+        transaction = HistoryTransaction(Selection(tuple(start), tuple(end)))
+        for top, end, text, replaced, replaced_end in data["e"]:
+            edit = HistoryEdit(tuple(top), tuple(end), text, replaced, tuple(replaced_end))
+            transaction.edits.append(edit)
+            transaction.size += edit.size
+        transaction.journaled = True
+        return transaction
+
+    def _reversed_records(self, journal:Path):
+        """Yield the journal's records from the last one backwards, reading it in blocks."""
+        with open(journal, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                size = min(self.BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + remainder).split(b"\n")
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield json.loads(line)
+            if remainder.strip():
+                yield json.loads(remainder)
+
+    def attach(self, history:EditHistory, path, text:str):
+        """Start journaling `history` for `path`, restoring older transactions on first undo."""
+        history.journal_path = os.path.abspath(path)
+        history.journal_pops = 0
+        history.journal_reset = True
+
+        journal = self.journal_path(path)
+        try:
+            records = self._reversed_records(journal)
+            last = next(records, None)
+            records.close()
+        except (OSError, ValueError):
+            return
+        if last is None or last.get("h") != self.content_hash(text):
+            return
+
+        history.journal_reset = False
+        history.loader = partial(self.load, journal)
+
+    def load(self, journal:Path, history:EditHistory):
+        transactions = []
+        # Journaled transactions still in memory, or undone since the last save, are the newest ones in the journal.
+        skip = sum(transaction.journaled for transaction in history.undo_stack) + history.journal_pops
+        size = history.size
+        try:
+            for record in self._reversed_records(journal):
+                if "r" in record:
+                    break
+                if "p" in record:
+                    skip += record["p"]
+                elif "t" in record:
+                    if skip > 0:
+                        skip -= 1
+                        continue
+                    transaction = self._decode(record["t"])
+                    size += transaction.size
+                    if len(transactions) + len(history.undo_stack) >= history.max_depth or size > history.max_bytes:
+                        break
+                    transactions.append(transaction)
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        transactions.reverse()
+        history.prepend(transactions)
+
+    def append(self, history:EditHistory, path, text:str):
+        """Write the transactions made since the last save, then mark `text` as the saved content."""
+        history.checkpoint()
+        if history.journal_path != os.path.abspath(path):
+            history.journal_path = os.path.abspath(path)
+            history.journal_reset = True
+            history.loader = None
+
+        records = []
+        if history.journal_reset:
+            records.append({"r": 1})
+            for transaction in history.undo_stack:
+                transaction.journaled = False
+        elif history.journal_pops > 0:
+            records.append({"p": history.journal_pops})
+        for transaction in history.undo_stack:
+            if not transaction.journaled:
+                records.append({"t": self._encode(transaction)})
+                transaction.journaled = True
+        for transaction in history.redo_stack:
+            # Redoing these would put back transactions the journal no longer has.
+            transaction.journaled = False
+        records.append({"h": self.content_hash(text)})
+
+        journal = self.journal_path(path)
+        try:
+            journal.parent.mkdir(parents=True, exist_ok=True)
+            with open(journal, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            if journal.stat().st_size > self.MAX_SIZE:
+                self.compact(history, journal, text)
+        except OSError:
+            history.journal_reset = True
+            return
+
+        history.journal_reset = False
+        history.journal_pops = 0
+
+    def compact(self, history:EditHistory, journal:Path, text:str):
+        """Rewrite the journal with only the transactions currently in the history."""
+        if history.loader is not None:
+            loader, history.loader = history.loader, None
+            loader(history)
+
+        records = [{"r": 1}]
+        records += [{"t": self._encode(transaction)} for transaction in history.undo_stack]
+        records.append({"h": self.content_hash(text)})
+
+        tmp = journal.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        os.replace(tmp, journal)
+
+class MappedFile:
+    """A read-only file mapped into memory, with the offset of every line start.
+
+    The offsets are built in chunks by `build`, which may run in a thread while lines
+    that are already indexed are read.
+    """
+
+    CHUNK_SIZE = 4 * 1024 * 1024
+    MAX_LINE_LENGTH = 64 * 1024
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.offsets = array.array("q", [0])
+        self.indexed = 0
+        self.max_length = 0
+        self.complete = self.size == 0
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    @property
+    def line_count(self) -> int:
+        # the last offset starts a line that is only known to be complete once the whole file is indexed
+        return len(self.offsets) if self.complete else len(self.offsets) - 1
+
+    def build(self, cancelled=None, progress=None):
+        """Index line starts in chunks, calling `progress` after each one."""
+        plus_one = (1).__add__
+        while self.indexed < self.size:
+            if cancelled is not None and cancelled():
+                return
+            start = self.indexed
+            end = self.map.rfind(b"\n", start, min(start + self.CHUNK_SIZE, self.size)) + 1
+            if end <= start:
+                # a line longer than a chunk, or the end of the file
+                end = self.map.find(b"\n", start + self.CHUNK_SIZE)
+                end = self.size if end == -1 else end + 1
+
+            lengths = list(map(len, self.map[start:end].split(b"\n")))
+            lengths.pop()
+            if lengths:
+                self.max_length = max(self.max_length, max(lengths))
+            starts = itertools.accumulate(map(plus_one, lengths), initial=start)
+            # the first one is the start of this chunk, already in the array
+            next(starts)
+            self.offsets.extend(starts)
+            self.indexed = end
+            if progress is not None:
+                progress(self)
+
+        if self.offsets[-1] == self.size and len(self.offsets) > 1:
+            # a trailing newline does not start a line of its own
+            self.offsets.pop()
+        else:
+            self.max_length = max(self.max_length, self.size - self.offsets[-1])
+        self.complete = True
+        if progress is not None:
+            progress(self)
+
+    def get_line(self, row:int) -> str:
+        start = self.offsets[row]
+        end = self.offsets[row + 1] - 1 if row + 1 < len(self.offsets) else self.size
+        end = min(end, start + self.MAX_LINE_LENGTH)
+        return self.map[start:end].decode("utf-8", errors="replace").rstrip("\r\n")
+
+class LargeFileView(ScrollView, can_focus=True):
+    """A read-only view of a MappedFile that only renders the visible lines."""
+
+    DEFAULT_CSS = """
+    LargeFileView {
+        width: 100%;
+        scrollbar-size: 1 1;
+    }
+    LargeFileView > .large-file--gutter {
+        color: $text-muted;
+    }
+    LargeFileView > .large-file--cursor-line {
+        background: $boost;
+    }
+    """
+
+    COMPONENT_CLASSES = {"large-file--gutter", "large-file--cursor-line"}
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "cursor up", show=False),
+        Binding("down", "cursor_down", "cursor down", show=False),
+        Binding("pageup", "cursor_page_up", "cursor page up", show=False),
+        Binding("pagedown", "cursor_page_down", "cursor page down", show=False),
+        Binding("home,ctrl+home", "cursor_top", "cursor top", show=False),
+        Binding("end,ctrl+end", "cursor_bottom", "cursor bottom", show=False),
+    ]
+
+    class Indexed(Event):
+        """Posted while the line index is built, and once it is complete."""
+
+        def __init__(self, view, complete:bool) -> None:
+            super().__init__()
+            self.view = view
+            self.complete = complete
+
+    class CursorMoved(Event):
+        """Posted when the cursor moves to another line."""
+
+        def __init__(self, view, row:int) -> None:
+            super().__init__()
+            self.view = view
+            self.row = row
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mapped = None
+        self.cursor_row = 0
+        self.gutter_width = 0
+
+    def open(self, path):
+        self.close()
+        self.mapped = MappedFile(path)
+        self.cursor_row = 0
+        self.scroll_to(0, 0, animate=False)
+        self.update_size()
+        self.build_index()
+
+    def close(self):
+        self.workers.cancel_group(self, "large_file_index")
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.virtual_size = Size(0, 0)
+        self.refresh()
+
+    @work(thread=True, exclusive=True, group="large_file_index")
+    def build_index(self):
+        worker = get_current_worker()
+        mapped = self.mapped
+        last_update = 0.0
+
+        def progress(mapped):
+            nonlocal last_update
+            now = time.monotonic()
+            if mapped.complete or now - last_update > 0.1:
+                last_update = now
+                self.app.call_from_thread(self.indexed, mapped)
+
+        mapped.build(lambda: worker.is_cancelled, progress)
+
+    def indexed(self, mapped):
+        if mapped is not self.mapped:
+            return
+        self.update_size()
+        self.post_message(self.Indexed(self, mapped.complete))
+
+    def update_size(self):
+        if self.mapped is None:
+            return
+        self.gutter_width = len(str(max(self.mapped.line_count, 1))) + 2
+        self.virtual_size = Size(self.gutter_width + min(self.mapped.max_length, MappedFile.MAX_LINE_LENGTH) + 1, self.mapped.line_count)
+        self.refresh()
+
+    def goto_line(self, row:int):
+        """Put the cursor on `row`, scrolled to the middle of the view."""
+        if self.mapped is None:
+            return
+        self.cursor_row = max(0, min(row, self.mapped.line_count - 1))
+        self.scroll_to(y=max(0, self.cursor_row - self.size.height // 2), animate=False)
+        self.refresh()
+
+    def move_cursor(self, row:int):
+        """Put the cursor on `row`, scrolling only as far as needed to show it."""
+        if self.mapped is None:
+            return
+        row = max(0, min(row, self.mapped.line_count - 1))
+        if row == self.cursor_row:
+            return
+        self.cursor_row = row
+        height = max(self.size.height, 1)
+        if row < self.scroll_offset.y:
+            self.scroll_to(y=row, animate=False)
+        elif row >= self.scroll_offset.y + height:
+            self.scroll_to(y=row - height + 1, animate=False)
+        self.refresh()
+        self.post_message(self.CursorMoved(self, row))
+
+    def action_cursor_up(self):
+        self.move_cursor(self.cursor_row - 1)
+
+    def action_cursor_down(self):
+        self.move_cursor(self.cursor_row + 1)
+
+    def action_cursor_page_up(self):
+        self.move_cursor(self.cursor_row - max(self.size.height - 1, 1))
+
+    def action_cursor_page_down(self):
+        self.move_cursor(self.cursor_row + max(self.size.height - 1, 1))
+
+    def action_cursor_top(self):
+        self.move_cursor(0)
+
+    def action_cursor_bottom(self):
+        if self.mapped is not None:
+            self.move_cursor(self.mapped.line_count - 1)
+
+    def render_line(self, y:int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        row = scroll_y + y
+        width = self.size.width
+        if self.mapped is None or row >= self.mapped.line_count:
+            return Strip.blank(width, self.rich_style)
+
+        line_style = self.get_component_rich_style("large-file--cursor-line") if row == self.cursor_row else self.rich_style
+        gutter = Segment(f"{row + 1:>{self.gutter_width - 1}} ", self.get_component_rich_style("large-file--gutter"))
+        text = Strip([Segment(self.mapped.get_line(row).expandtabs(4), line_style)])
+        text = text.crop(scroll_x, scroll_x + width - self.gutter_width).extend_cell_length(width - self.gutter_width, line_style)
+        return Strip([gutter, *text])
+
+class SwapFile:
+    """Crash recovery file for an open buffer, kept under the cache directory.
+
+    The first edit after opening or saving writes a header with the pid of this process and
+    the hash of the saved text. Every edit then appends its delta, so an edit costs the same
+    however large the document is. Every COMPACT_EDITS edits the file is rewritten as a
+    snapshot of the text. A swap file whose process is gone was left by a crash.
+    """
+
+    COMPACT_EDITS = 1000
+
+    def __init__(self, directory, path, base_text:str):
+        self.directory = Path(directory) / CACHE_DIR / "swap"
+        self.path = os.path.abspath(path)
+        self.swap_path = self.directory / (hashlib.sha1(self.path.encode("utf-8", "surrogateescape")).hexdigest()[:16] + ".swp")
+        self.base = UndoJournal.content_hash(base_text)
+        self.file = None
+        self.edits = 0
+
+    def header(self) -> dict:
+        return {"path": self.path, "pid": os.getpid(), "base": self.base}
+
+    def record(self, top, bottom, text:str, document_text):
+        """Append one edit. `document_text` returns the whole text, for compaction."""
+        try:
+            if self.file is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.file = open(self.swap_path, "w")
+                self.file.write(json.dumps(self.header()) + "\n")
+            self.file.write(json.dumps({"e": [top, bottom, text]}) + "\n")
+            self.file.flush()
+            self.edits += 1
+            if self.edits >= self.COMPACT_EDITS:
+                self.compact(document_text())
+        except OSError:
+            pass
+
+    def compact(self, text:str):
+        self.close()
+        tmp = self.swap_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write(json.dumps(self.header()) + "\n")
+            f.write(json.dumps({"s": text}) + "\n")
+        os.replace(tmp, self.swap_path)
+        self.file = open(self.swap_path, "a")
+        self.edits = 0
+
+    def reset(self, base_text:str):
+        """The buffer was saved as `base_text`, so nothing is left to recover."""
+        self.remove()
+        self.base = UndoJournal.content_hash(base_text)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        self.edits = 0
+        with contextlib.suppress(OSError):
+            os.remove(self.swap_path)
+
+    @staticmethod
+    def read(swap_path):
+        """Return the header and the records of a swap file, ignoring a torn last line."""
+        records = []
+        with open(swap_path) as f:
+            header = json.loads(f.readline())
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return header, records
+
+    @staticmethod
+    def recover(swap_path) -> str:
+        """Rebuild the text of the buffer. Raises ValueError if the saved text it started from changed."""
+        header, records = SwapFile.read(swap_path)
+        document = None
+        if not any("s" in record for record in records):
+            with open(header["path"]) as f:
+                text = f.read()
+            if UndoJournal.content_hash(text) != header["base"]:
+                raise ValueError(f"{header['path']} changed since the swap file was written")
+            document = Document(text)
+
+        for record in records:
+            if "s" in record:
+                document = Document(record["s"])
+            elif "e" in record and document is not None:
+                top, bottom, text = record["e"]
+                document.replace_range(tuple(top), tuple(bottom), text)
+        return document.text
+
+    @staticmethod
+    def find_orphans(directory) -> list:
+        """Swap files under `directory` whose process is no longer running."""
+        orphans = []
+        for swap_path in sorted((Path(directory) / CACHE_DIR / "swap").glob("*.swp")):
+            try:
+                with open(swap_path) as f:
+                    header = json.loads(f.readline())
+                os.kill(header["pid"], 0)
+            except ProcessLookupError:
+                orphans.append((swap_path, header["path"]))
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+        return orphans
+
+class FindIndex:
+    """Matches of a find query, kept per document line and updated as the document is edited.
+
+    Matches never span lines. The query is compiled once, and only the lines touched by an
+    edit are searched again.
+    """
+
+    def __init__(self):
+        self.pattern = None
+        self.query = ""
+        self.regex = False
+        self.case_sensitive = False
+        self.lines = []
+        self.count = 0
+        self.stale = True
+        self.narrow = False
+
+    def compile(self, query:str, regex=False, case_sensitive=False):
+        """Set the query. Raises re.error for an invalid regular expression."""
+        flags = 0 if case_sensitive else re.IGNORECASE
+        pattern = re.compile(query if regex else re.escape(query), flags)
+
+        # a literal query that extends the previous one can only match on lines that matched before
+        narrow = (not self.stale and self.pattern is not None and not regex and not self.regex
+                  and case_sensitive == self.case_sensitive and query.startswith(self.query))
+
+        self.pattern = pattern
+        self.query = query
+        self.regex = regex
+        self.case_sensitive = case_sensitive
+
+        if narrow:
+            self.narrow = True
+        else:
+            self.stale = True
+
+    def clear(self):
+        self.stale = True
+        self.narrow = False
+        self.lines = []
+        self.count = 0
+
+    def _match_line(self, line:str) -> tuple:
+        return tuple((m.start(), m.end()) for m in self.pattern.finditer(line) if m.end() > m.start())
+
+    def build(self, document):
+        """Bring the matches up to date with the query, searching only the lines that need it."""
+        if self.pattern is None:
+            return
+        match_line = self._match_line
+        if self.stale:
+            self.lines = [match_line(line) for line in document.lines]
+        elif self.narrow:
+            lines = document.lines
+            self.lines = [match_line(lines[row]) if spans else spans for row, spans in enumerate(self.lines)]
+        else:
+            return
+        self.count = sum(map(len, self.lines))
+        self.stale = False
+        self.narrow = False
+
+    def edited(self, document, top_row:int, old_bottom_row:int, new_bottom_row:int):
+        """Search again the lines from `top_row` to `new_bottom_row`, which replaced `top_row` to `old_bottom_row`."""
+        if self.stale or self.pattern is None:
+            return
+        new = [self._match_line(document.get_line(row)) for row in range(top_row, new_bottom_row + 1)]
+        old = self.lines[top_row:old_bottom_row + 1]
+        self.count += sum(map(len, new)) - sum(map(len, old))
+        self.lines[top_row:old_bottom_row + 1] = new
+
+    def find(self, location, forward=True, wrap=True):
+        """Return (start, end, wrapped) of the next match after `location`, or the previous one before it."""
+        if not self.count:
+            return None
+        lines = self.lines
+        row, column = location
+
+        if forward:
+            for start, end in lines[row]:
+                if start >= column:
+                    return (row, start), (row, end), False
+            rows = range(row + 1, len(lines))
+            wrapped_rows = range(0, row + 1)
+        else:
+            for start, end in reversed(lines[row]):
+                if start < column:
+                    return (row, start), (row, end), False
+            rows = range(row - 1, -1, -1)
+            wrapped_rows = range(len(lines) - 1, row - 1, -1)
+
+        for row in rows:
+            if lines[row]:
+                start, end = lines[row][0 if forward else -1]
+                return (row, start), (row, end), False
+        if not wrap:
+            return None
+        for row in wrapped_rows:
+            if lines[row]:
+                start, end = lines[row][0 if forward else -1]
+                return (row, start), (row, end), True
+        return None
+
+    def position(self, start) -> int:
+        """One based index of the match starting at `start`, or 0 if there is none."""
+        row, column = start
+        if row >= len(self.lines):
+            return 0
+        for i, span in enumerate(self.lines[row]):
+            if span[0] == column:
+                return sum(map(len, self.lines[:row])) + i + 1
+        return 0
+
+    def expand(self, document, start, end, replacement:str) -> str:
+        """The text that replaces the match from `start` to `end`, or None if it no longer matches there."""
+        if not self.regex:
+            return replacement
+        # match against the whole line, so lookaheads can see past the end of the match
+        match = self.pattern.match(document.get_line(start[0]), start[1])
+        if match is None or match.end() != end[1]:
+            return None
+        return match.expand(replacement)
+
+    def replace_all(self, document, replacement:str):
+        """Return (text, start, end, count) of one edit that replaces every match."""
+        rows = [row for row, spans in enumerate(self.lines) if spans]
+        if not rows:
+            return None
+        first, last = rows[0], rows[-1]
+
+        if self.regex:
+            substitute = lambda m: m.expand(replacement) if m.end() > m.start() else m.group(0)
+        else:
+            substitute = lambda m: replacement
+
+        lines = document.lines
+        text = document.newline.join(self.pattern.sub(substitute, lines[row]) if self.lines[row] else lines[row]
+                                     for row in range(first, last + 1))
+        return text, (first, 0), (last, len(lines[last])), self.count
+
+class TableModel:
+    """The markdown table at the cursor, kept current through edits so it can be realigned as you type.
+
+    `rows` holds the content width of every cell of each row, or None for the separator row.
+    Each column keeps a histogram of its cell widths, so its width is known without scanning
+    the table. `realign` rewrites the rows edited since the last realign, and the cells of the
+    columns whose width changed, as a single edit.
+    """
+
+    ROW_RE = re.compile(r"\s*\|")
+    PIPE_RE = re.compile(r"(?<!\\)\|")
+    SEPARATOR_RE = re.compile(r":?-+:?")
+    MIN_WIDTH = 1
+
+    def __init__(self):
+        self.clear()
+        self.realigning = False
+
+    def clear(self):
+        self.top = None
+        self.rows = []
+        self.histograms = []
+        self.alignments = []
+        self.aligned = []
+        self.dirty = set()
+
+    @property
+    def bottom(self) -> int:
+        return self.top + len(self.rows) - 1
+
+    @classmethod
+    def cells(cls, line:str) -> list[tuple]:
+        """(start, end) of the text of each cell of a row."""
+        pipes = [match.start() for match in cls.PIPE_RE.finditer(line)]
+        spans = [(start + 1, end) for start, end in zip(pipes, pipes[1:])]
+        # a row does not need a closing pipe
+        if pipes and line[pipes[-1] + 1:].strip():
+            spans.append((pipes[-1] + 1, len(line)))
+        return spans
+
+    def _parse(self, line:str):
+        texts = [line[start:end].strip() for start, end in self.cells(line)]
+        if texts and all(self.SEPARATOR_RE.fullmatch(text) for text in texts):
+            alignments = [
+                "center" if text[0] == text[-1] == ":" else "left" if text[0] == ":" else "right" if text[-1] == ":" else None
+                for text in texts
+            ]
+            if alignments != self.alignments:
+                # every column is padded again
+                self.alignments = alignments
+                self.aligned = []
+            return None
+        return [len(text) for text in texts]
+
+    def _count(self, widths, step:int):
+        if widths is None:
+            return
+        for column, width in enumerate(widths):
+            if column == len(self.histograms):
+                self.histograms.append(collections.Counter())
+            histogram = self.histograms[column]
+            histogram[width] += step
+            if not histogram[width]:
+                del histogram[width]
+
+    def widths(self) -> list[int]:
+        return [max(self.MIN_WIDTH, max(histogram, default=0)) for histogram in self.histograms]
+
+    def locate(self, document, row:int) -> bool:
+        """Whether `row` is in a table, reading the table if it is not the one already modelled."""
+        if self.top is not None and self.top <= row <= self.bottom:
+            return True
+        self.clear()
+        if not self.ROW_RE.match(document.get_line(row)):
+            return False
+
+        top = bottom = row
+        while top > 0 and self.ROW_RE.match(document.get_line(top - 1)):
+            top -= 1
+        while bottom + 1 < document.line_count and self.ROW_RE.match(document.get_line(bottom + 1)):
+            bottom += 1
+        self.top = top
+        self.rows = [self._parse(document.get_line(r)) for r in range(top, bottom + 1)]
+        for widths in self.rows:
+            self._count(widths, 1)
+        # a table is taken as it is until it is edited
+        self.aligned = self.widths()
+        return True
+
+    def edited(self, document, top_row:int, old_bottom_row:int, new_bottom_row:int):
+        """Update the rows replaced by an edit of `top_row` to `old_bottom_row`, now ending at `new_bottom_row`."""
+        if self.top is None or self.realigning:
+            # padding cells leaves their widths as they are
+            return
+        if old_bottom_row < self.top - 1:
+            self.top += new_bottom_row - old_bottom_row
+            return
+        if top_row > self.bottom + 1:
+            return
+        if top_row < self.top or old_bottom_row > self.bottom:
+            # the edit reaches outside the table, so read it again when it is next needed
+            self.clear()
+            return
+
+        rows = []
+        for r in range(top_row, new_bottom_row + 1):
+            line = document.get_line(r)
+            if not self.ROW_RE.match(line):
+                self.clear()
+                return
+            rows.append(self._parse(line))
+
+        first, last = top_row - self.top, old_bottom_row - self.top
+        shift = new_bottom_row - old_bottom_row
+        for widths in self.rows[first:last + 1]:
+            self._count(widths, -1)
+        for widths in rows:
+            self._count(widths, 1)
+        self.rows[first:last + 1] = rows
+        self.dirty = {row if row < first else row + shift for row in self.dirty if not first <= row <= last}
+        self.dirty.update(range(first, first + len(rows)))
+
+    def _pad(self, text:str, width:int, alignment) -> str:
+        if alignment == "left":
+            return text.ljust(width)
+        if alignment == "right":
+            return text.rjust(width)
+        left = (width - len(text)) // 2
+        return " " * left + text + " " * (width - len(text) - left)
+
+    def _separator(self, width:int, alignment) -> str:
+        dashes = "-" * width
+        if alignment == "left":
+            return ":" + dashes + "-"
+        if alignment == "right":
+            return "-" + dashes + ":"
+        if alignment == "center":
+            return ":" + dashes + ":"
+        return "-" + dashes + "-"
+
+    def format(self, line:str, widths:list, columns=None, separator=False, cursor=None) -> str:
+        """`line` with its cells, or only those in `columns`, padded to `widths`.
+
+        The cell holding the `cursor` column keeps the spaces typed before the cursor.
+        """
+        parts = []
+        last = 0
+        for column, (start, end) in enumerate(self.cells(line)):
+            if column >= len(widths) or (columns is not None and column not in columns):
+                continue
+            alignment = self.alignments[column] if column < len(self.alignments) else None
+            if separator:
+                cell = self._separator(widths[column], alignment)
+            else:
+                if cursor is not None and start <= cursor <= end and line[start:cursor].strip():
+                    text = line[start:cursor].lstrip() + line[cursor:end].rstrip()
+                else:
+                    text = line[start:end].strip()
+                cell = " " + self._pad(text, max(widths[column], len(text)), alignment) + " "
+            parts.append(line[last:start])
+            parts.append(cell)
+            last = end
+        parts.append(line[last:])
+        return "".join(parts)
+
+    def empty_row(self, line:str) -> str:
+        """A row with the indent of `line` and empty cells as wide as the columns."""
+        indent = line[:len(line) - len(line.lstrip())]
+        return indent + "|" + "|".join(" " * (width + 2) for width in self.widths()) + "|"
+
+    def cell_at(self, line:str, column:int) -> int:
+        for index, (start, end) in enumerate(self.cells(line)):
+            if start <= column <= end:
+                return index
+        return -1
+
+    def cell_location(self, line:str, row:int, index:int, offset:int=0):
+        """Where the text of a cell starts, plus `offset` characters into it."""
+        spans = self.cells(line)
+        if not spans:
+            return None
+        start, end = spans[max(0, min(index, len(spans) - 1))]
+        text = line[start:end]
+        if not text.strip():
+            return (row, min(start + 1, end))
+        content = text.lstrip()
+        return (row, start + len(text) - len(content) + min(offset, len(content)))
+
+    def next_cell(self, document, row:int, column:int, forwards:bool):
+        """The start of the cell after, or before, the one at (row, column), moving between rows."""
+        index = self.cell_at(document.get_line(row), column) + (1 if forwards else -1)
+        while self.top <= row <= self.bottom:
+            line = document.get_line(row)
+            count = len(self.cells(line))
+            if self.rows[row - self.top] is not None and 0 <= index < count:
+                return self.cell_location(line, row, index)
+            row += 1 if forwards else -1
+            if not self.top <= row <= self.bottom:
+                return None
+            index = 0 if forwards else len(self.cells(document.get_line(row))) - 1
+        return None
+
+    def next_row_cell(self, document, row:int, column:int, forwards:bool):
+        """The same cell in the row below, or above, skipping the separator. None past the last row."""
+        index = self.cell_at(document.get_line(row), column)
+        step = 1 if forwards else -1
+        row += step
+        while self.top <= row <= self.bottom and self.rows[row - self.top] is None:
+            row += step
+        if not self.top <= row <= self.bottom:
+            return None
+        return self.cell_location(document.get_line(row), row, index)
+
+    def realign(self, text_area:TextArea, columns:bool=False) -> bool:
+        """Pad the edited rows, keeping the cursor in its cell. Returns whether a column width changed.
+
+        With `columns`, the cells of the columns whose width changed are padded in every row
+        too. That rewrites the whole table, so it is left until typing pauses.
+        """
+        if self.top is None:
+            return False
+        widths = self.widths()
+        changed = {column for column, width in enumerate(widths) if column >= len(self.aligned) or self.aligned[column] != width}
+        rows = set(self.dirty)
+        if columns:
+            if changed:
+                rows.update(range(len(self.rows)))
+            self.aligned = widths
+        document = text_area.document
+        row, column = text_area.cursor_location
+
+        old_lines = {}
+        new_lines = {}
+        for i in sorted(rows):
+            line = document.get_line(self.top + i)
+            new = self.format(line, widths, None if i in self.dirty else changed, self.rows[i] is None,
+                              column if self.top + i == row else None)
+            if new != line:
+                old_lines[i] = line
+                new_lines[i] = new
+        self.dirty.clear()
+        pending = bool(changed) and not columns
+        if not new_lines:
+            return pending
+
+        cursor = None
+        if self.top <= row <= self.bottom:
+            line = document.get_line(row)
+            index = self.cell_at(line, column)
+            if index >= 0:
+                start, end = self.cells(line)[index]
+                text = line[start:end]
+                cursor = (index, column - start - (len(text) - len(text.lstrip())))
+
+        first, last = min(new_lines), max(new_lines)
+        old_first, new_first = old_lines[first], new_lines[first]
+        old_last, new_last = old_lines[last], new_lines[last]
+        prefix = 0
+        while prefix < min(len(old_first), len(new_first)) and old_first[prefix] == new_first[prefix]:
+            prefix += 1
+        suffix = 0
+        limit = min(len(old_last), len(new_last)) - (prefix if first == last else 0)
+        while suffix < limit and old_last[-1 - suffix] == new_last[-1 - suffix]:
+            suffix += 1
+
+        if first == last:
+            text = new_first[prefix:len(new_first) - suffix]
+        else:
+            middle = [new_lines.get(i, document.get_line(self.top + i)) for i in range(first + 1, last)]
+            text = "\n".join([new_first[prefix:], *middle, new_last[:len(new_last) - suffix]])
+        self.realigning = True
+        try:
+            text_area.replace(text, (self.top + first, prefix), (self.top + last, len(old_last) - suffix))
+        finally:
+            self.realigning = False
+
+        if cursor is not None:
+            index, offset = cursor
+            location = self.cell_location(document.get_line(row), row, index, max(offset, 0))
+            if location is not None:
+                text_area.move_cursor(location)
+        return pending
+
+class Buffer:
+    """A file that is not shown, kept with its parsed document, history, view and the tokens of its preview."""
+
+    __slots__ = ("path", "document", "wrapped_document", "navigator", "language", "highlight_query",
+                 "highlights", "history", "selection", "scroll", "stat", "preview", "size")
+
+    def __init__(self, path, document, wrapped_document, navigator, language, highlight_query, highlights, history, selection, scroll):
+        self.path = path
+        self.document = document
+        self.wrapped_document = wrapped_document
+        self.navigator = navigator
+        self.language = language
+        self.highlight_query = highlight_query
+        self.highlights = highlights
+        self.history = history
+        self.selection = selection
+        self.scroll = scroll
+        self.stat = None
+        self.preview = None
+        self.size = 0
+
+class BufferCache:
+    """Buffers of recently shown files, evicting the least recently shown past `max_bytes`.
+
+    Only files whose text matches what is on disk are kept. The size of a buffer is an estimate
+    of its document and highlights from the length of its text, plus its history and the
+    parsed tokens of its preview.
+    """
+
+    TEXT_OVERHEAD = 4
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.buffers = collections.OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def key(path) -> str:
+        return os.path.abspath(path)
+
+    def put(self, buffer:Buffer, text_length:int) -> list[Buffer]:
+        """Keep `buffer`, returning the buffers evicted to make room for it."""
+        replaced = self.take(buffer.path)
+        buffer.size = text_length * self.TEXT_OVERHEAD + buffer.history.size
+        if buffer.preview is not None:
+            buffer.size += buffer.preview[1][0]
+        self.buffers[self.key(buffer.path)] = buffer
+        self.size += buffer.size
+
+        evicted = [replaced] if replaced is not None else []
+        while self.size > self.max_bytes and self.buffers:
+            _, oldest = self.buffers.popitem(last=False)
+            self.size -= oldest.size
+            evicted.append(oldest)
+        return evicted
+
+    def take(self, path) -> Buffer:
+        buffer = self.buffers.pop(self.key(path), None)
+        if buffer is not None:
+            self.size -= buffer.size
+        return buffer
+
+    def get(self, path) -> Buffer:
+        return self.buffers.get(self.key(path))
+
+class PageEntry:
+    """Data of the last node of a large directory, standing in for the entries not shown yet.
+
+    It has no path, so nothing that acts on the cursor's path can act on the directory instead.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.loaded = True
+
+    @property
+    def label(self) -> str:
+        return f"... {len(self.entries)} more"
+
+class ExtendedDirectoryTree(DirectoryTree):
+    """A DirectoryTree that applies file system changes to the affected node instead of reloading.
+
+    Nodes are found by path, so the cursor and the expanded directories stay where they are
+    when entries are added, removed or renamed above them. Ignored paths are left out, and
+    directories are shown PAGE_SIZE entries at a time; selecting the last node shows more.
+    """
+
+    PAGE_SIZE = 500
+
+    def __init__(self, path, ignore=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.ignore = ignore if ignore is not None else IgnoreMatcher(path)
+
+    @staticmethod
+    def entry_key(entry) -> tuple:
+        name, is_dir = entry
+        return (not is_dir, name.lower())
+
+    @staticmethod
+    def sort_key(node) -> tuple:
+        if isinstance(node.data, PageEntry):
+            return (2, "")
+        return (not node.allow_expand, node.data.path.name.lower())
+
+    def filter_paths(self, paths):
+        return [path for path in paths if not self.ignore.ignored(path, self._safe_is_dir(path))]
+
+    @work(thread=True)
+    def _load_directory(self, node) -> list:
+        """List a directory as sorted (name, is_dir) pairs, without the ignored entries."""
+        worker = get_current_worker()
+        prefix = self.ignore.prefix(node.data.path)
+        entries = []
+        try:
+            with os.scandir(node.data.path) as it:
+                for entry in it:
+                    if worker.is_cancelled:
+                        break
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not self.ignore.match(prefix + entry.name, is_dir):
+                        entries.append((entry.name, is_dir))
+        except OSError:
+            pass
+        entries.sort(key=self.entry_key)
+        return entries
+
+    def _populate_node(self, node, content):
+        node.remove_children()
+        self._add_page(node, content)
+        node.expand()
+
+    def _add_page(self, parent, entries):
+        for name, is_dir in entries[:self.PAGE_SIZE]:
+            parent.add(name, data=DirEntry(parent.data.path / name), allow_expand=is_dir)
+        if len(entries) > self.PAGE_SIZE:
+            page = PageEntry(entries[self.PAGE_SIZE:])
+            parent.add(page.label, data=page, allow_expand=False)
+
+    def _page_node(self, parent):
+        children = parent.children
+        if children and isinstance(children[-1].data, PageEntry):
+            return children[-1]
+        return None
+
+    def show_more(self, node):
+        """Replace the node standing in for the rest of a directory with its next page."""
+        parent = node.parent
+        entries = node.data.entries
+        node.remove()
+        first = len(parent.children)
+        self._add_page(parent, entries)
+        self._build()
+        self.select_node(parent.children[first])
+
+    def _on_tree_node_selected(self, event:Tree.NodeSelected):
+        if isinstance(event.node.data, PageEntry):
+            event.stop()
+            event.prevent_default()
+            self.show_more(event.node)
+
+    def cursor_path(self):
+        """The path of the cursor node, or None when there is none or it stands in for more entries."""
+        node = self.cursor_node
+        if node is None or node.data is None or isinstance(node.data, PageEntry):
+            return None
+        return node.data.path
+
+    def find_node(self, path):
+        """The node of `path`, or None when it, or one of its parents, has not been listed yet."""
+        try:
+            parts = Path(os.path.abspath(path)).relative_to(os.path.abspath(self.root.data.path)).parts
+        except ValueError:
+            return None
+        node = self.root
+        for part in parts:
+            for child in node.children:
+                if not isinstance(child.data, PageEntry) and child.data.path.name == part:
+                    node = child
+                    break
+            else:
+                return None
+        return node
+
+    def _insert_sorted(self, parent, node):
+        children = parent._children
+        children.remove(node)
+        children.insert(bisect.bisect_left([self.sort_key(child) for child in children], self.sort_key(node)), node)
+        self._invalidate()
+
+    def add_path(self, path):
+        """Add a node for a created file or directory, if its parent has been listed."""
+        path = Path(path)
+        parent = self.find_node(path.parent)
+        if parent is None or not parent.data.loaded or not parent.allow_expand:
+            return None
+        for child in parent.children:
+            if not isinstance(child.data, PageEntry) and child.data.path.name == path.name:
+                return child
+        path = parent.data.path / path.name
+        if not self.filter_paths([path]):
+            return None
+
+        page = self._page_node(parent)
+        entry = (path.name, self._safe_is_dir(path))
+        if page is not None and len(parent.children) > 1 and self.entry_key(entry) > self.sort_key(parent.children[-2]):
+            # sorts among the entries not shown yet
+            entries = page.data.entries
+            if entry not in entries:
+                entries.insert(bisect.bisect_left([self.entry_key(e) for e in entries], self.entry_key(entry)), entry)
+                page.set_label(page.data.label)
+            return None
+
+        node = parent.add(path.name, data=DirEntry(path), allow_expand=entry[1])
+        self._insert_sorted(parent, node)
+        return node
+
+    def remove_path(self, path):
+        """Remove the node of a deleted file or directory, moving the cursor off it first."""
+        node = self.find_node(path)
+        if node is None:
+            parent = self.find_node(Path(path).parent)
+            page = self._page_node(parent) if parent is not None else None
+            if page is not None:
+                page.data.entries = [entry for entry in page.data.entries if entry[0] != Path(path).name]
+                if page.data.entries:
+                    page.set_label(page.data.label)
+                else:
+                    page.remove()
+            return
+        if node.is_root:
+            return
+        cursor = self.cursor_node
+        while cursor is not None and cursor is not node:
+            cursor = cursor.parent
+        if cursor is node:
+            siblings = node.parent.children
+            index = siblings.index(node)
+            if index + 1 < len(siblings):
+                self.select_node(siblings[index + 1])
+            elif index > 0:
+                self.select_node(siblings[index - 1])
+            else:
+                self.select_node(node.parent)
+        node.remove()
+
+    def rename_path(self, old, new):
+        """Move the node of a renamed file or directory, keeping its children and expansion."""
+        old, new = Path(old), Path(new)
+        node = self.find_node(old)
+        parent = self.find_node(new.parent)
+        if node is None or node.is_root or parent is not node.parent:
+            self.remove_path(old)
+            return self.add_path(new)
+
+        old = node.data.path
+        new = parent.data.path / new.name
+        stack = [node]
+        while stack:
+            child = stack.pop()
+            if not isinstance(child.data, PageEntry):
+                child.data.path = new / child.data.path.relative_to(old)
+            stack.extend(child.children)
+        node.set_label(new.name)
+        self._insert_sorted(parent, node)
+        return node
+
+    def expanded_paths(self) -> list:
+        """Paths of the expanded directories, parents first."""
+        paths = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.is_expanded and node.data is not None:
+                paths.append(node.data.path)
+                stack.extend(reversed(node.children))
+        return paths
+
+    async def reload_paths(self, expanded, cursor=None):
+        """Reload from disk, then expand `expanded` again and put the cursor back on `cursor`."""
+        await self.reload_node(self.root)
+        for path in expanded[1:]:
+            node = self.find_node(path)
+            if node is not None and node.allow_expand:
+                await self._add_to_load_queue(node)
+                node.expand()
+        if cursor is not None:
+            node = self.find_node(cursor)
+            if node is not None:
+                self.select_node(node)
+
 class ExtendedTextArea(TextArea):
     """A subclass of TextArea with parenthesis-closing functionality."""
     BINDINGS = [
@@ -308,6 +3199,167 @@ class ExtendedTextArea(TextArea):
         Binding("ctrl+k", "delete_to_end_of_line", "delete to line end", show=False),
     ]
 
+    # seconds without typing before a table's columns are realigned
+    TABLE_REALIGN_DELAY = 0.3
+
+    def __init__(self, *args, history:EditHistory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.edit_history = history if history is not None else EditHistory()
+        self.applying_history = False
+        self.find_index = FindIndex()
+        self.table_model = TableModel()
+        self.table_timer = None
+        self.swap_file = None
+        self.edit_count = 0
+
+    def _edit(self, edit:Edit) -> EditResult:
+        self.edit_count += 1
+        with SPANS.span("edit and parse"):
+            result = super().edit(edit)
+        top, bottom = sorted((edit.from_location, edit.to_location))
+        self.find_index.edited(self.document, top[0], bottom[0], result.end_location[0])
+        self.table_model.edited(self.document, top[0], bottom[0], result.end_location[0])
+        if self.swap_file is not None:
+            self.swap_file.record(top, bottom, edit.text, lambda: self.text)
+        return result
+
+    def edit(self, edit:Edit) -> EditResult:
+        """Perform an edit, recording its inverse in the edit history."""
+        selection = self.selection
+        result = self._edit(edit)
+        if not self.applying_history:
+            top, bottom = sorted((edit.from_location, edit.to_location))
+            self.edit_history.record(HistoryEdit(top, result.end_location, edit.text, result.replaced_text, bottom), selection)
+        return result
+
+    def undo(self) -> bool:
+        transaction = self.edit_history.pop_undo()
+        if transaction is None:
+            return False
+
+        self.applying_history = True
+        try:
+            for item in reversed(transaction.edits):
+                result = self._edit(Edit(item.replaced, item.top, item.end, False))
+                item.replaced_end = result.end_location
+        finally:
+            self.applying_history = False
+        self.selection = transaction.selection
+        return True
+
+    def redo(self) -> bool:
+        transaction = self.edit_history.pop_redo()
+        if transaction is None:
+            return False
+
+        self.applying_history = True
+        try:
+            for item in transaction.edits:
+                self._edit(Edit(item.text, item.top, item.replaced_end, False))
+        finally:
+            self.applying_history = False
+        return True
+
+    def load_text(self, text:str) -> None:
+        self.load_document(text, self.language)
+
+    def load_document(self, text:str, language:str=None) -> None:
+        """Replace the text and the language together, so the new text is only parsed once."""
+        if language is not None and language not in self.available_languages:
+            raise LanguageDoesNotExist(f"{language!r} is not a builtin language, or it has not been registered.")
+        if PRIVATE_TEXT_AREA:
+            # set the reactive without its watcher, which would parse the old text
+            self._reactive_language = language
+            self._set_document(text, language)
+        else:
+            self.language = language
+            super().load_text(text)
+        self.edit_history.clear()
+        self.find_index.clear()
+        self.table_model.clear()
+
+    def store_buffer(self, path) -> Buffer:
+        """Hand over the document and history of `path`, leaving fresh ones for the next file."""
+        buffer = Buffer(path, self.document, self.wrapped_document, self.navigator, self.language, self._highlight_query,
+                        self._highlights, self.edit_history, self.selection, self.scroll_offset)
+        self._highlights = collections.defaultdict(list)
+        self.edit_history = EditHistory(self.edit_history.max_depth, self.edit_history.max_bytes)
+        return buffer
+
+    def restore_buffer(self, buffer:Buffer) -> None:
+        """Show a stored buffer as it was, without parsing or highlighting it again."""
+        self._reactive_language = buffer.language
+        self._highlight_query = buffer.highlight_query
+        self._highlights = buffer.highlights
+        self.document = buffer.document
+        self.wrapped_document = buffer.wrapped_document
+        self.navigator = buffer.navigator
+        self.edit_history = buffer.history
+        self.find_index.clear()
+        self.table_model.clear()
+        self._rewrap_and_refresh_virtual_size()
+        self.selection = buffer.selection
+        self.call_after_refresh(self.scroll_to, *buffer.scroll, animate=False)
+
+    def ensure_language(self, name:str):
+        """Register the grammar and highlight query of `name` the first time it is used."""
+        if name in self._languages:
+            return
+        grammar = GRAMMARS.get(name)
+        if grammar is None:
+            scm_file = Path(SCM_PATH) / f"{name}.scm"
+            if scm_file.exists():
+                highlight_query = scm_file.read_text()
+            else:
+                highlight_query = TextArea._get_builtin_highlight_query(name)
+            from tree_sitter_languages import get_language
+            grammar = GRAMMARS[name] = (get_language(name), highlight_query)
+        self.register_language(*grammar)
+
+    def _build_highlight_map(self) -> None:
+        with SPANS.span("highlighting"):
+            super()._build_highlight_map()
+
+    def _set_document(self, text:str, language:str) -> None:
+        """TextArea._set_document, reusing the compiled highlight query of registered languages."""
+        if not PRIVATE_TEXT_AREA:
+            super()._set_document(text, language)
+            return
+        text_area_language = self._languages.get(language) if language else None
+        if text_area_language is None:
+            super()._set_document(text, language)
+            return
+
+        self._highlight_query = None
+        try:
+            document = SyntaxAwareDocument(text, text_area_language.language)
+        except SyntaxAwareDocumentError:
+            document = Document(text)
+        else:
+            key = (language, text_area_language.highlight_query)
+            if key not in HIGHLIGHT_QUERIES:
+                HIGHLIGHT_QUERIES[key] = document.prepare_query(text_area_language.highlight_query)
+            self._highlight_query = HIGHLIGHT_QUERIES[key]
+
+        self.document = document
+        self.wrapped_document = WrappedDocument(document, tab_width=self.indent_width)
+        self.navigator = DocumentNavigator(self.wrapped_document)
+        self._build_highlight_map()
+        self.move_cursor((0, 0))
+        self._rewrap_and_refresh_virtual_size()
+
+    def selection_length(self) -> int:
+        """Length of the selected text, worked out from the selection coordinates."""
+        start, end = sorted(self.selection)
+        if start[0] == end[0]:
+            return end[1] - start[1]
+
+        newline = len(self.document.newline)
+        length = len(self.document.get_line(start[0])) - start[1] + newline
+        for row in range(start[0] + 1, end[0]):
+            length += len(self.document.get_line(row)) + newline
+        return length + end[1]
+
     def _skip_bookend_ends(self, bookend_start: str, bookend_end: str) -> None:
         if self.selected_text == "":
             start = self.cursor_location
@@ -351,62 +3403,45 @@ class ExtendedTextArea(TextArea):
             #self.selection = (selection.start, selection.end + len(bookend_end + bookend_start))
     
     
-    def _next_cell(self, forwards:bool) -> bool:
-        text = self.get_text_range(self.get_cursor_line_start_location(), self.cursor_location)
-
-        if not self.selected_text == "":
+    def _table_row(self) -> bool:
+        """Whether the cursor is in a markdown table, with nothing selected."""
+        if self.language != "markdown" or not self.selection.is_empty:
             return False
+        row = self.cursor_location[0]
+        model = self.table_model
+        if self.table_timer is not None and (model.top is None or not model.top <= row <= model.bottom):
+            # finish the table being left before reading another
+            self._realign_columns()
+        return model.locate(self.document, row)
+
+    def _realign_table(self) -> None:
+        """Pad the edited row now, and the columns whose width changed once typing pauses."""
+        with SPANS.span("table realign"):
+            pending = self.table_model.realign(self)
+        if pending:
+            if self.table_timer is not None:
+                self.table_timer.stop()
+            self.table_timer = self.set_timer(self.TABLE_REALIGN_DELAY, self._realign_columns)
+
+    def _realign_columns(self) -> None:
+        if self.table_timer is not None:
+            self.table_timer.stop()
+            self.table_timer = None
+        # joins the typing it follows, so one undo reverts both
+        with self.edit_history.group(join=True), SPANS.span("table realign"):
+            self.table_model.realign(self, columns=True)
 
-        if not text.startswith("|"):
+    def _next_cell(self, forwards:bool) -> bool:
+        # if in markdown table go to next cell
+        if not self._table_row():
             return False
 
-        # if in markdown table go to next cell
-        if not self.language == "markdown":
+        location = self.table_model.next_cell(self.document, *self.cursor_location, forwards)
+        if location is None:
             return False
+        self.move_cursor(location)
+        return True
 
-        cursor = self.cursor_location
-        if forwards:
-            start = (cursor[0], cursor[1] + 1)
-            end = self.get_cursor_line_end_location()
-        else:
-            start = self.get_cursor_line_start_location()
-            end = (cursor[0], cursor[1] - 1)
-
-        text = self.get_text_range(start, end)
-        #find next pipe
-        if forwards:
-            match = re.search(r'\|', text)
-            if match:
-                space = 3
-                match_start = match.start() + space
-                self.move_cursor_relative(columns=match_start)
-                #self.notify(f"Moving cursor forward to {match_start}. Searched from {str(start)} to {str(end)}")
-                return True
-        else:
-            # When moving backwards, we need to find the pipe that comes before the cursor's current position
-            start = self.get_cursor_line_start_location()
-            end = (cursor[0], cursor[1] - 1)
-
-            # Extract the text range for searching
-            text_before_cursor = self.get_text_range(start, end)
-
-            # Find the last pipe in the text before the cursor
-            match = re.search(r'\|(?=[^\|]*$)', text_before_cursor)
-            if match:
-                # Calculate the position of the cursor relative to the start of the line
-                match_pos = match.start()
-
-                # Move cursor to the left of the matched pipe character
-                # We subtract from the cursor's current column position the difference
-                # between the match position and the end column position of the text before the cursor
-                cursor_move_distance = match_pos - end[1]
-                self.move_cursor_relative(columns=cursor_move_distance)
-                #self.notify(f"Moving cursor backwards to {cursor_move_distance}. Searched from {str(start)} to {str(end)}")
-                return True
-            
-        self.notify(f"No match from {str(start)} to {str(end)}")
-        return False 
-    
     def _whitespace(self, spaces: int) -> None:
         
         start_location = self.get_cursor_line_start_location()
@@ -475,81 +3510,17 @@ class ExtendedTextArea(TextArea):
         if match:
             return f'\n{leading_whitespace}- '
 
-        # Regular expression to match a markdown table row
-        table_row_re = re.compile(r'^\s*\|?(?:[^\|]*\|)+[^\|]*\|?\s*$')
-
-
-        # check if next line can be calculated
-
-        if self.cursor_location[0] != self.get_cursor_down_location()[0]:
-            # Get the start and end locations of the next line
-            next_start = self.get_cursor_line_start_location()
-            next_start = (next_start[0] + 1, next_start[1])
-            next_end = self.get_cursor_line_end_location()
-            next_end = (next_end[0] + 1, next_end[1])
-
-            # Retrieve the next line of text
-            next_line = self.get_text_range(next_start, next_end)
-
-            # Notify about the next line - for debugging purposes
-            #self.notify(f"Next line: {next_line}")
-            next_line_match = table_row_re.match(next_line)
-        else:
-            next_line_match = False
-
-        # #TODO: Hack
-        this_line = self.document.get_line(self.cursor_location[0])
-
-        # Check if the previous line is a table row and the next line is not
-        if table_row_re.match(this_line) and not next_line_match:
-            # Split the previous line into columns, taking into account leading and trailing spaces within the cells
-            # We also maintain the outer spaces outside the first and last pipe
-            leading_spaces = this_line[:this_line.find('|')]
-            trailing_spaces = this_line[this_line.rfind('|')+1:]
-            columns = this_line.strip().split('|')[1:-1]  # Exclude the first and last empty elements after strip
-            
-            # Create a new row that maintains the same spacing as the previous row's columns
-            new_row = leading_spaces + '\n|' + '|'.join(' ' * len(col) for col in columns) + '|' + trailing_spaces
-            self.insert(new_row, (self.cursor_location[0], len(self.document.lines[self.cursor_location[0]])))
-            return None
-
-        # Check if the next line is a table row
-        elif next_line_match:
-            # Assuming you are in a table and next_line_match is True, indicating the next line is also a table row
-
-            # Get the content of the current line up to the cursor's column position
-            current_cursor_row, current_cursor_column = self.cursor_location
-            current_line_start = (current_cursor_row, 0)
-            current_line_up_to_cursor = self.get_text_range(current_line_start, self.cursor_location)
-
-            # Count the number of pipes (cells) before the cursor on the current line to find the cell index
-            cell_index = current_line_up_to_cursor.count('|')
-
-            # Move the cursor down one row
-            self.move_cursor_relative(rows=1)
-
-            # Now retrieve the content of the next line
-            next_line_start = (current_cursor_row + 1, 0)
-            next_line_end = self.get_cursor_line_end_location()
-            next_line_end = (next_line_end[0] + 1, next_line_end[1])
-            next_line = self.get_text_range(next_line_start, next_line_end)
-
-            # Find the position of the same cell in the next line by finding the nth pipe
-            # corresponding to the cell index
-            pipe_count = 0
-            column_position = 0
-            for char in next_line:
-                if char == '|':
-                    pipe_count += 1
-                if pipe_count == cell_index:
-                    break
-                column_position += 1
-
-            # Now we have the column position of the pipe that marks the beginning of the target cell in the next line
-            # We move the cursor to the right of that pipe, which should be the start of the cell
-            # We need to add 1 to position the cursor inside the cell, right after the pipe
-            self.move_cursor_relative(columns=column_position - current_cursor_column + 1)
-
+        if self._table_row():
+            row, column = self.cursor_location
+            location = self.table_model.next_row_cell(self.document, row, column, True)
+            if location is None:
+                # add a row below the last one and move into the same cell
+                line = self.document.get_line(row)
+                index = self.table_model.cell_at(line, column)
+                empty_row = self.table_model.empty_row(line)
+                self.insert("\n" + empty_row, (row, len(line)))
+                location = self.table_model.cell_location(empty_row, row + 1, index)
+            self.move_cursor(location)
             return None
 
         return '\n'
@@ -566,52 +3537,52 @@ class ExtendedTextArea(TextArea):
             self.insert(ret)
             return
         
-    def _on_key(self, event: events.Key) -> None:
-        #self.notify(f"{event.character}  |  {event.aliases}")
-
+    def _bookend_key(self, event: events.Key) -> bool:
+        """Insert, or skip over, the pair of a bookend character. Returns whether it was one."""
         if event.character == "(":
             self._insert_bookend_pair("(", ")")
-            event.prevent_default() 
         elif event.character == "[":
             self._insert_bookend_pair("[", "]")
-            event.prevent_default()
         elif event.character == "{":
             self._insert_bookend_pair("{", "}")
-            event.prevent_default()
         elif event.character == "'":
             self._insert_bookend_pair("'", "'")
-            event.prevent_default()
         elif event.character == '"':
             self._insert_bookend_pair('"', '"')
-            event.prevent_default()
         elif event.character == "`":
             self._insert_bookend_pair("`", "`", only_selection=True)
-            event.prevent_default()
         elif event.character == "<":
             self._insert_bookend_pair("<", ">")
-            event.prevent_default()
         elif event.character == "~":
             self._insert_bookend_pair("~", "~", only_selection = True)
-            event.prevent_default()
         elif event.character == "*":
             self._insert_bookend_pair("*", "*", only_selection = True)
-            event.prevent_default()
 
         # check bookend ends
         elif event.character == ")":
             self._skip_bookend_ends("(", ")")
-            event.prevent_default()
-
         elif event.character == "]":
             self._skip_bookend_ends("[", "]")
-            event.prevent_default()
-
         elif event.character == "}":
             self._skip_bookend_ends("{", "}")
-            event.prevent_default()
-
         elif event.character == ">":
             self._skip_bookend_ends("<", ">")
+        else:
+            return False
+        return True
+
+    def _on_key(self, event: events.Key) -> None:
+        #self.notify(f"{event.character}  |  {event.aliases}")
+
+        if event.is_printable and self._table_row():
+            # the typed character and the realign it causes are undone together
+            with self.edit_history.group(join=True):
+                if not self._bookend_key(event):
+                    self.replace(event.character, *self.selection, maintain_selection_offset=False)
+                self._realign_table()
+            event.prevent_default()
+
+        elif self._bookend_key(event):
             event.prevent_default()
 
         elif "shift+tab" in event.aliases:
@@ -625,16 +3596,131 @@ class ExtendedTextArea(TextArea):
             event.prevent_default()
         
         elif "shift+enter" in event.aliases:
-            regex = table_row_re = re.compile(r'^\s*\|?(?:[^\|]*\|)+[^\|]*\|?\s*$')
-            if regex.match(self.get_text_range(self.get_cursor_line_start_location(), self.get_cursor_line_end_location)):
-                self.move_cursor_relative(rows=-11)
+            # in a table, move to the same cell of the row above
+            if self._table_row():
+                location = self.table_model.next_row_cell(self.document, *self.cursor_location, False)
+                if location is not None:
+                    self.move_cursor(location)
+                event.prevent_default()
 
         # if enter in list of aliases
         elif "enter" in event.aliases:
             self._newline()
             event.prevent_default()
 
+    def action_delete_left(self) -> None:
+        if not self._table_row():
+            return super().action_delete_left()
+        with self.edit_history.group(join=True):
+            super().action_delete_left()
+            self._realign_table()
 
+    def action_delete_right(self) -> None:
+        if not self._table_row():
+            return super().action_delete_right()
+        with self.edit_history.group(join=True):
+            super().action_delete_right()
+            self._realign_table()
+
+
+
+class SpanTimer:
+    """Rolling timings of named spans around the hot paths.
+
+    While disabled, `span` returns a shared no-op context manager, so instrumented code pays
+    for one attribute check. While enabled, the last WINDOW durations of every span are kept
+    for percentiles and, with --timings, each span is appended to a JSON lines file.
+    """
+
+    WINDOW = 512
+
+    class Span:
+        __slots__ = ("timer", "name", "start")
+
+        def __init__(self, timer, name):
+            self.timer = timer
+            self.name = name
+
+        def __enter__(self):
+            self.start = time.perf_counter()
+            return self
+
+        def __exit__(self, *exc):
+            self.timer.record(self.name, self.start, time.perf_counter() - self.start)
+            return False
+
+    def __init__(self):
+        self.enabled = False
+        self.durations = {}
+        self.lock = threading.Lock()
+        self.export = None
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return SpanTimer.Span(self, name)
+
+    def record(self, name, start, duration):
+        with self.lock:
+            samples = self.durations.get(name)
+            if samples is None:
+                samples = self.durations[name] = collections.deque(maxlen=self.WINDOW)
+            samples.append(duration)
+            if self.export is not None:
+                self.export.write(json.dumps({"span": name, "time": time.time() - (time.perf_counter() - start), "ms": duration * 1000}) + "\n")
+
+    def export_to(self, path):
+        self.export = open(path, "a", buffering=64 * 1024)
+        self.enabled = True
+
+    def close(self):
+        with self.lock:
+            if self.export is not None:
+                self.export.close()
+                self.export = None
+
+    def percentiles(self) -> list:
+        """(name, count, p50, p95, p99, max) in milliseconds for every span, slowest p95 first."""
+        with self.lock:
+            snapshot = {name: sorted(samples) for name, samples in self.durations.items()}
+        rows = []
+        for name, samples in snapshot.items():
+            n = len(samples)
+            rows.append((name, n, samples[n // 2] * 1000, samples[min(n - 1, n * 95 // 100)] * 1000,
+                         samples[min(n - 1, n * 99 // 100)] * 1000, samples[-1] * 1000))
+        return sorted(rows, key=lambda row: -row[3])
+
+NULL_SPAN = contextlib.nullcontext()
+SPANS = SpanTimer()
+
+class StartupProfile:
+    """Wall clock time of each startup phase, reported by --profile-startup."""
+
+    def __init__(self):
+        self.phases = {"imports": IMPORT_TIME}
+        self.first_paint = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        # only the first time a phase runs is part of startup
+        self.phases.setdefault(name, seconds)
+
+    def paint(self):
+        if self.first_paint is None:
+            self.first_paint = time.perf_counter() - STARTUP_TIME
+
+    def report(self) -> str:
+        lines = [f"{name:<20}{seconds * 1000:9.1f} ms" for name, seconds in self.phases.items()]
+        if self.first_paint is not None:
+            lines.append(f"{'first paint':<20}{self.first_paint * 1000:9.1f} ms after start")
+        return "\n".join(lines)
 
 class Noteri(App):
     CSS_PATH = "noteri.tcss"
@@ -654,6 +3740,10 @@ class Noteri(App):
         Binding("ctrl+f", "find", "Find Text", priority=True),
         Binding("ctrl+v", "paste", "Paste Text", priority=True),
         Binding("ctrl+f", "find", "Find Text", priority=True),
+        Binding("ctrl+shift+f", "search_vault", "Search in Vault", priority=True),
+        Binding("f3", "find_next", "Find Next"),
+        Binding("ctrl+g", "goto_line", "Go to Line"),
+        Binding("shift+f3", "find_previous", "Find Previous"),
         Binding("ctrl+t", "table", "Create Table"),
         Binding("ctrl+shift+t", "bullet_list", "Create Bullet List"),
         Binding("ctrl+shift+n", "numbered_list", "Create Numbered List"),
@@ -683,7 +3773,7 @@ class Noteri(App):
             self.input = input
 
 
-    def __init__(self, path="./"):
+    def __init__(self, path="./", undo_depth=1000, undo_memory=32, large_file_size=50, autosave=0, recover=(), profile_startup=False, timings=None, buffer_memory=64):
         super().__init__()
 
         self.directory = "./"
@@ -694,17 +3784,35 @@ class Noteri(App):
         self.action_stack = []
         self.selected_directory = self.directory
         self.backlinks = []
-        self.history_index = 0
-        self.history = []
-        self.history_disabled = False
-        self.history_counter = 0
         self.markdown_updates = []
         self.write_lock = threading.Lock()
-        self.unprinted_changes = True
+        self.footer_text = None
+        self.opening = None
+        self.markdown_timer = None
+        self.markdown_render_time = 0.0
+        self.markdown_rendering = False
+        self.markdown_pending = False
         self.last_find = ""
+        self.last_replace = ""
+        self.find_regex = False
+        self.find_case_sensitive = False
 
         self.expand_lock = threading.Lock()
         self.allowed_to_expand = True
+        self.undo_depth = undo_depth
+        self.undo_memory = undo_memory
+        self.large_file_size = large_file_size * 1024 * 1024
+        self.autosave = autosave
+        self.autosave_timer = None
+        self.orphaned_swaps = list(recover)
+        self.startup_profile = StartupProfile() if profile_startup else None
+        self.open_started = 0.0
+        self.timings_timer = None
+        self.buffers = BufferCache(buffer_memory * 1024 * 1024 if PRIVATE_TEXT_AREA else 0)
+        self.saved_edit_count = 0
+        self.disk_stat = None
+        if timings is not None:
+            SPANS.export_to(timings)
 
         path = Path(path)
         if path.is_file():
@@ -715,19 +3823,42 @@ class Noteri(App):
         elif path.is_dir():
             self.directory = path
             self.selected_directory = path
+
+        self.ignore = IgnoreMatcher(self.directory)
+        self.backlink_index = BacklinkIndex(self.directory, self.ignore)
+        self.file_index = FileIndex(self.directory, self.ignore)
+        self.path_search = PathSearchIndex()
+        self.fulltext_index = FullTextIndex(self.directory, self.ignore)
+        self.undo_journal = UndoJournal(self.directory)
+        self.file_writer = FileWriter()
         
 
 
+    def profile(self, name):
+        """Time a startup phase when --profile-startup is given."""
+        if self.startup_profile is None:
+            return contextlib.nullcontext()
+        return self.startup_profile.phase(name)
+
+    def on_ready(self):
+        if self.startup_profile is not None:
+            self.startup_profile.paint()
+
     def compose(self) -> ComposeResult:
+        with self.profile("compose"):
+            yield from self.compose_widgets()
+
+    def compose_widgets(self) -> ComposeResult:
         self.ta = ExtendedTextArea(id="text_area",
+        history = EditHistory(self.undo_depth, self.undo_memory * 1024 * 1024),
         theme = "monokai",
         soft_wrap = False,
         tab_behaviour = "indent",
         show_line_numbers = True)
-        
-        for scm_file in Path(SCM_PATH).glob("*.scm"):
-            self.app.ta.register_language(get_language(scm_file.stem), scm_file.read_text())
-        self.markdown = Markdown(id="markdown")
+
+        self.markdown = IncrementalMarkdown(id="markdown")
+        self.large_file = LargeFileView(id="large_file")
+        self.large_file.display = False
         #self.table_of_contents = Markdown(id="table_of_contents")
         
         #Find  Binding("ctrl+x", "delete_line", "delete line", show=False) in self.ta., and remove it
@@ -736,103 +3867,170 @@ class Noteri(App):
         self.app.ta.delete_word_right = self.action_find
         #with Vertical():
         with Horizontal():
-            yield DirectoryTree(self.directory)
+            yield ExtendedDirectoryTree(self.directory, self.ignore)
             yield self.ta
+            yield self.large_file
             with Vertical(id="md"):
-                yield Markdown("", id="title")
+                yield IncrementalMarkdown("", id="title")
                 with ScrollableContainer(id = "scrollable_markdown"):
                     #yield self.table_of_contents
                     yield self.markdown
-                    yield Markdown(id="backlinks")
+                    yield IncrementalMarkdown(id="backlinks")
                     #yield RadioButton(id="todo")
 
+        timings = Static(id="timings")
+        timings.display = False
+        yield timings
         yield Label(id="footer")
 
     def on_mount(self):
+        self.footer = self.query_one("#footer", expect_type=Label)
         self.ta.focus()
         self.query_one("#markdown", expect_type=Markdown).display = False
         self.open_file(self.filename)
-        self.dt = self.query_one("DirectoryTree", expect_type=DirectoryTree)
+        self.dt = self.query_one("DirectoryTree", expect_type=ExtendedDirectoryTree)
         self.refresh_directory_tree()
         self.print_footer()
         #self.query_one("#radio_buttons", expect_type=RadioButton).display = False
-        self.run_worker(self._update_markdown_worker, exit_on_error=True, thread=True )
-        self.run_worker(self._update_footer_worker, exit_on_error=True, thread=True)
-
+        if not str(self.filename).endswith(".md"):
+            self.update_backlinks()
+        self.watch_files()
+        self.build_fulltext_index()
+        self.write_files()
+        self.offer_recovery()
+
+    def on_unmount(self):
+        self.file_writer.flush()
+        SPANS.close()
+        if self.ta.swap_file is not None:
+            if self.unsaved_changes:
+                self.ta.swap_file.close()
+            else:
+                self.ta.swap_file.remove()
+        self.backlink_index.save()
+        self.fulltext_index.save()
+
+    @work(thread=True, exclusive=True, group="fulltext_index")
+    def build_fulltext_index(self):
+        worker = get_current_worker()
+        self.fulltext_index.load()
+        self.fulltext_index.refresh(lambda: worker.is_cancelled or not self.is_running)
+
+    @work(thread=True, exclusive=True, group="file_watcher")
+    def watch_files(self):
+        """Populate the file index and keep it, and the link index, current until the app exits."""
+        worker = get_current_worker()
+        self.file_index.load()
+        watcher = FileWatcher(self.directory, self.file_system_changed, ignore=self.ignore)
+        watcher.run(lambda: worker.is_cancelled or not self.is_running, ready=self.file_index.scan)
+
+    @work(thread=True, group="file_writer")
+    def write_files(self):
+        """Write saved files in the background until the app exits."""
+        worker = get_current_worker()
+        self.file_writer.run(lambda: worker.is_cancelled or not self.is_running)
+
+    def file_system_changed(self, kind, path):
+        if kind in ("created", "deleted"):
+            self.call_from_thread(self.tree_changed, kind, path)
+        if kind == "rescan":
+            self.call_from_thread(self.refresh_directory_tree)
+            self.file_index.scan()
+            self.backlink_index.ready = False
+            self.build_fulltext_index()
+        elif kind == "deleted":
+            self.file_index.remove(path)
+            self.backlink_index.remove_file(path)
+            self.fulltext_index.remove_file(path)
+        elif kind == "created":
+            self.file_index.add(path)
+            if path.endswith(".md"):
+                self.backlink_index.update_file(path)
+            if os.path.isdir(path):
+                self.backlink_index.ready = False
+                self.build_fulltext_index()
+            else:
+                self.fulltext_index.update_file(path)
+        elif kind == "modified":
+            if path.endswith(".md"):
+                self.backlink_index.update_file(path)
+            self.fulltext_index.update_file(path)
 
-    def _update_footer_worker(self):
-        while self.app.is_running:
-            if self.unprinted_footer:
-                unsaved_char = ""
-                if self.unsaved_changes:
-                    unsaved_char = "*"
 
-                filename = self.filename
-                if self.filename is None:
-                    filename = "New File"
-                
-                language = self.ta.language
-                    
-                if language is None:
-                    language = "Plain Text"
-
-                selected_text = self.ta.selected_text
-                #calculate selection width
-                cursor_width = ""
-                if len(selected_text) > 0:
-                    cursor_width = f" : {len(selected_text)}"
-
-                cursor_location = self.ta.cursor_location
-                self.query_one("#footer", expect_type=Label).update( 
-                f"{self.selected_directory} | {unsaved_char}{filename} | {language} | {str(cursor_location)}{cursor_width}"
-                )
-                self.unprinted_footer = False
+    def print_footer(self):
+        """Rebuild the status bar. Called when the selection changes and on file open and save."""
+        unsaved_char = "*" if self.unsaved_changes else ""
+        filename = "New File" if self.filename is None else self.filename
+        language = self.ta.language if self.ta.language is not None else "Plain Text"
+
+        mapped = self.large_file.mapped
+        if mapped is not None:
+            if mapped.complete:
+                progress = f"{mapped.line_count} lines"
+            else:
+                progress = f"Indexing {mapped.indexed * 100 // max(mapped.size, 1)}%"
+            footer_text = f"{self.selected_directory} | {filename} | Read Only | {progress} | Line {self.large_file.cursor_row + 1}"
+            if footer_text != self.footer_text:
+                self.footer_text = footer_text
+                self.footer.update(footer_text)
+            return
 
-            time.sleep(1)
+        #calculate selection width
+        cursor_width = ""
+        selection_length = self.ta.selection_length()
+        if selection_length > 0:
+            cursor_width = f" : {selection_length}"
 
-    @work(thread=True, exclusive=True)
-    def print_footer(self):
-        self.unprinted_footer = True
+        footer_text = f"{self.selected_directory} | {unsaved_char}{filename} | {language} | {str(self.ta.cursor_location)}{cursor_width}"
+        if footer_text != self.footer_text:
+            self.footer_text = footer_text
+            self.footer.update(footer_text)
 
     @on(TextArea.SelectionChanged)
     def cursor_moved(self, event:TextArea.SelectionChanged) -> None:
         self.print_footer()
 
-    @work(thread=True, exclusive=True)
     @on (TextArea.Changed, "#text_area")
-    def on_text_area_changed(self, event:TextArea.Changed) -> None:
-        self.history_counter += 1
-        self.unsaved_changes = True
+    def text_changed(self, event:TextArea.Changed) -> None:
+        if not self.unsaved_changes:
+            self.unsaved_changes = True
+            self.print_footer()
+        if self.autosave:
+            self.schedule_autosave()
 
-        # with self.write_lock:
-        self.unprinted_changes = True
-        #self.unprinted_changes = True
-        if self.history_counter > 5:
-            self.add_history()
-
-    def _update_markdown_worker(self):
-        while self.app.is_running:
-            if self.unprinted_changes:
-                if self.unprinted_changes:
-                        if self.ta.language == "markdown":
-                            self.unprinted_changes = False
-                            self.call_after_refresh(self._update_markdown)
-            time.sleep(1)
+    PREVIEW_DEBOUNCE_MIN = 0.02
+    PREVIEW_DEBOUNCE_MAX = 1.0
 
-    async def _update_markdown(self):
-        sc = None
-        try:
-            sc = self.app.query_one("#scrollable_markdown", expect_type=ScrollableContainer)
-            x = sc.scroll_x
-            y = sc.scroll_y
-        except:
-            pass
+    @on (TextArea.Changed, "#text_area")
+    def schedule_markdown_update(self, event:TextArea.Changed=None) -> None:
+        """Refresh the preview once typing pauses for about twice as long as the last render took."""
+        if self.ta.language != "markdown":
+            return
 
-        if self.ta.language == "markdown":
-            await self.markdown.update(self.ta.text)
+        if self.markdown_timer is not None:
+            self.markdown_timer.stop()
+        delay = min(max(self.markdown_render_time * 2, self.PREVIEW_DEBOUNCE_MIN), self.PREVIEW_DEBOUNCE_MAX)
+        self.markdown_timer = self.set_timer(delay, self._update_markdown)
 
-        if sc is not None:
-            sc.scroll_to(x, y, animate=False)
+    async def _update_markdown(self):
+        self.markdown_timer = None
+        if self.markdown_rendering:
+            self.markdown_pending = True
+            return
+
+        self.markdown_rendering = True
+        try:
+            while True:
+                self.markdown_pending = False
+                if self.ta.language == "markdown":
+                    start = time.perf_counter()
+                    with SPANS.span("markdown preview"):
+                        await self.markdown.update(self.ta.text)
+                    self.markdown_render_time = time.perf_counter() - start
+                if not self.markdown_pending:
+                    break
+        finally:
+            self.markdown_rendering = False
 
     @on(DirectoryTree.FileSelected)
     def file_selected(self, event:DirectoryTree.FileSelected):
@@ -928,33 +4126,64 @@ class Noteri(App):
 
         self.open_file(path)
 
-    def _update_backlinks_helper(self, path:Path):
-        glob = list(Path(path).glob("./*"))
+    @work(thread=True, exclusive=True, group="backlinks")
+    def update_backlinks(self):
+        """Show the backlinks of the current file, validating the link index first if needed.
+
+        Matches are streamed into the backlinks panel while the index is validated. Opening
+        another file cancels this worker; the files validated so far stay in the index.
+        """
+        with SPANS.span("backlinks"):
+            self._update_backlinks(get_current_worker())
+
+    def _update_backlinks(self, worker):
+        index = self.backlink_index
+        filename = self.filename if str(self.filename).endswith(".md") else None
+
+        index.load()
+        if filename is not None:
+            backlinks = index.backlinks(filename)
+            self.call_from_thread(self.print_backlinks, filename, backlinks, index.ready)
+        if index.ready:
+            return
+
+        found = set(backlinks) if filename is not None else set()
+        target = BacklinkIndex.key(filename) if filename is not None else None
+        last_print = time.monotonic()
+        unprinted = False
 
-        for item in glob:
-            if item.name[0] == ".":
+        for source, targets in index.iter_refresh():
+            if worker.is_cancelled:
+                return
+            if target is None:
                 continue
 
-            if item.is_dir():
-                self._update_backlinks_helper(item)
-            elif item.name.endswith(".md"):
-                with open(item, "r") as f:
-                    text = f.read()
-                    if text.find( self.filename.name + ")") != -1:
-                        self.backlinks.append(item)
+            if target in targets and Path(source) not in found:
+                found.add(Path(source))
+                unprinted = True
+            if unprinted and time.monotonic() - last_print > 0.1:
+                self.call_from_thread(self.print_backlinks, filename, sorted(found), False)
+                last_print = time.monotonic()
+                unprinted = False
+
+        if filename is not None:
+            self.call_from_thread(self.print_backlinks, filename, index.backlinks(filename), True)
+
+    def print_backlinks(self, filename, backlinks, complete=True):
+        if filename != self.filename:
+            return
 
-    def update_backlinks(self):
-        self.backlinks.clear()
         bl = self.query_one("#backlinks", expect_type=Markdown)
-        self._update_backlinks_helper(self.directory)
+        self.backlinks = backlinks
 
         backlink_text = ""
 
-        #TODO: Sort
-
         for item in self.backlinks:
             backlink_text += f"- [{item.name}]({str(item)})\n"
 
+        if not complete:
+            backlink_text += "\n*Searching...*\n"
+
         if backlink_text != "":
             bl.display = True
             bl.styles.height = "auto"
@@ -965,7 +4194,9 @@ class Noteri(App):
         backlink_text = "###\n### Backlinks\n" + backlink_text
         bl.update(backlink_text)
 
-    def open_file(self, path: Path) -> None:
+    OPEN_CHUNK_SIZE = 1024 * 1024
+
+    def open_file(self, path: Path, cursor=None) -> None:
 
         if path == None:
             return
@@ -973,28 +4204,132 @@ class Noteri(App):
             return
 
         if self.unsaved_changes:
-            self.action_stack.insert(0, partial(self.open_file, path))
+            self.action_stack.insert(0, partial(self.open_file, path, cursor))
             self.push_screen(YesNoPopup("Unsaved Changes",  self.unsaved_changes_callback, message=f"Save Changes to {self.filename} ?"))
             return
 
         path = Path(path)
-        
+        self.opening = path
+        self.open_started = time.perf_counter()
+
+        buffer = self.buffers.take(path)
+        if buffer is not None and (self.file_writer.busy(path) or buffer.stat == self.file_stat(path)):
+            self.show_buffer(path, buffer, cursor)
+            return
+        self.read_file(path, cursor)
+
+    @staticmethod
+    def file_stat(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def stash_buffer(self, next_path=None):
+        """Keep the file being left for `next_path` in the buffer cache, if it matches what is on disk."""
+        if self.filename is None or self.large_file.mapped is not None or self.ta.edit_count != self.saved_edit_count:
+            return
+        if self.buffers.max_bytes == 0:
+            return
+        if next_path is not None and self.buffers.key(next_path) == self.buffers.key(self.filename):
+            return
+        text = self.ta.document.text
+        buffer = self.ta.store_buffer(self.filename)
+        buffer.stat = self.disk_stat
+        if self.ta.language == "markdown":
+            # keep the parsed tokens rather than the widgets, so the preview is rebuilt without parsing
+            digest = MARKDOWN_TOKENS.digest(text)
+            entry = MARKDOWN_TOKENS.get(digest)
+            if entry is not None:
+                buffer.preview = (digest, entry)
+        self.buffers.put(buffer, len(text))
+
+    def show_buffer(self, path:Path, buffer:Buffer, cursor=None):
+        """Show a file from the buffer cache, as it was left."""
+        self.opening = None
+        self.stash_buffer(path)
+        if self.ta.swap_file is not None:
+            self.ta.swap_file.remove()
+        with SPANS.span("load document"):
+            self.ta.restore_buffer(buffer)
+        self.saved_edit_count = self.ta.edit_count
+        self.disk_stat = buffer.stat
+        self.ta.swap_file = SwapFile(self.directory, path, self.ta.document.text)
+        if buffer.preview is not None:
+            MARKDOWN_TOKENS.restore(*buffer.preview)
+        self.call_after_refresh(self._update_markdown)
+        self.file_shown(path, cursor)
 
+    @work(thread=True, exclusive=True, group="open_file")
+    def read_file(self, path:Path, cursor=None):
+        """Read a file in chunks, showing progress in the footer. Opening another file cancels it."""
+        worker = get_current_worker()
         try:
+            size = path.stat().st_size
+            if size > self.large_file_size:
+                self.call_from_thread(self.file_read, path, None, cursor)
+                return
+
+            chunks = []
+            last_update = time.monotonic()
+            self.file_writer.wait(path)
             with open(path) as f:
-                text = f.read()
-                self.ta.load_text(text)
-                self.filename = path
-                self.selected_directory = path.parent
+                while chunk := f.read(self.OPEN_CHUNK_SIZE):
+                    if worker.is_cancelled:
+                        return
+                    chunks.append(chunk)
+                    if time.monotonic() - last_update > 0.1:
+                        last_update = time.monotonic()
+                        self.call_from_thread(self.print_open_progress, path, f.buffer.tell(), size)
 
         except FileNotFoundError as e:
-            self.notify(f"File not found: {path}", severity="error", title="FileNotFoundError")
+            self.call_from_thread(self.open_failed, path)
+            self.call_from_thread(self.notify, f"File not found: {path}", severity="error", title="FileNotFoundError")
             return
         except UnicodeDecodeError as e:
-            #self.notify(f"File is not a text file: {path}", severity="error", title="UnicodeDecodeError")
-            os.system(f"open \"{path}\"")
+            self.call_from_thread(self.open_failed, path)
+            try:
+                subprocess.Popen(["open", str(path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError:
+                self.call_from_thread(self.notify, f"File is not a text file: {path}", severity="error", title="UnicodeDecodeError")
+            return
+        except OSError as e:
+            self.call_from_thread(self.open_failed, path)
+            self.call_from_thread(self.notify, f"Could not open {path}: {e.strerror}", severity="error", title=type(e).__name__)
+            return
+
+        if not worker.is_cancelled:
+            self.call_from_thread(self.file_read, path, "".join(chunks), cursor)
+
+    def open_failed(self, path:Path):
+        """Stop waiting for `path`, so autosave and the footer carry on with the open file."""
+        if path != self.opening:
+            return
+        self.opening = None
+        self.print_footer()
+
+    def print_open_progress(self, path, done, size):
+        if path != self.opening:
             return
-         
+        self.footer_text = f"{self.selected_directory} | Opening {path} | {done * 100 // max(size, 1)}%"
+        self.footer.update(self.footer_text)
+
+    def file_read(self, path:Path, text, cursor=None):
+        """Show a file read by read_file. `text` is None for a large file."""
+        if path != self.opening:
+            return
+        if self.unsaved_changes:
+            # the open file was edited while this one was being read
+            self.action_stack.insert(0, partial(self.file_read, path, text, cursor))
+            self.push_screen(YesNoPopup("Unsaved Changes",  self.unsaved_changes_callback, message=f"Save Changes to {self.filename} ?"))
+            return
+        self.opening = None
+
+        if text is None:
+            self.open_large_file(path)
+            return
+
         file_extensions = {
             ".sh": "bash",
             ".css": "css",
@@ -1009,17 +4344,34 @@ class Noteri(App):
             ".yaml": "yaml",
         }
 
+        language = None
         if path.suffix in file_extensions:
             try:
-                self.ta.language = file_extensions[path.suffix]
-            except LanguageDoesNotExist:
+                with self.profile("grammar"):
+                    self.ta.ensure_language(file_extensions[path.suffix])
+                language = file_extensions[path.suffix]
+            except (LanguageDoesNotExist, OSError, AttributeError):
                 self.notify(f"Issue loading {file_extensions[path.suffix]} language.", title="Language Error", severity="error")
-                self.ta.language = None
             except NameError:
                 self.notify(f"Issue loading {file_extensions[path.suffix]} language.", title="Language Error", severity="error")
-                self.ta.language = None
-        else:
-            self.ta.language = None
+
+        self.stash_buffer(path)
+        if self.ta.swap_file is not None:
+            self.ta.swap_file.remove()
+        with SPANS.span("load document"):
+            self.ta.load_document(text, language)
+        self.saved_edit_count = self.ta.edit_count
+        self.disk_stat = self.file_stat(path)
+        self.ta.swap_file = SwapFile(self.directory, path, text)
+        self.undo_journal.attach(self.ta.edit_history, path, text)
+        self.call_after_refresh(self._update_markdown)
+        self.file_shown(path, cursor)
+
+    def file_shown(self, path:Path, cursor=None):
+        """Update the rest of the window for the file now in the text area."""
+        self.filename = path
+        self.selected_directory = path.parent
+        self.close_large_file()
 
         title = self.query_one("#title", expect_type=Markdown)
         backlinks = self.query_one("#backlinks", expect_type=Markdown)
@@ -1037,17 +4389,83 @@ class Noteri(App):
             self.markdown.display = False
             backlinks.display = False
 
-        self.history.clear()
-        self.history_index = 0
+        self.configure_widths()
+
+        self.unsaved_changes = False
+        self.print_footer()
+
+        if cursor is not None:
+            self.ta.move_cursor(cursor, center=True)
+            self.ta.focus()
+
+        if self.startup_profile is not None:
+            self.startup_profile.add("file open", time.perf_counter() - self.open_started)
+
+    def action_close(self):
+        """Close the current file, leaving an empty buffer."""
+        if self.unsaved_changes:
+            self.action_stack.insert(0, self.action_close)
+            self.push_screen(YesNoPopup("Unsaved Changes",  self.unsaved_changes_callback, message=f"Save Changes to {self.filename} ?"))
+            return
 
-        self.call_later(self.add_history)
+        self.opening = None
+        self.close_large_file()
+        self.stash_buffer()
+        if self.ta.swap_file is not None:
+            self.ta.swap_file.remove()
+            self.ta.swap_file = None
+        self.ta.load_document("", None)
+        self.saved_edit_count = self.ta.edit_count
+        self.filename = None
 
+        self.markdown.display = False
+        self.query_one("#title").display = False
+        self.query_one("#backlinks").display = False
         self.configure_widths()
 
         self.unsaved_changes = False
-        self.unprinted_footer = True
-        self.unprinted_changes  = True
-        self.call_after_refresh(self._update_markdown)
+        self.print_footer()
+
+    def open_large_file(self, path:Path):
+        """Show a file above the large file size read only, without highlighting or preview."""
+        try:
+            self.large_file.open(path)
+        except OSError as e:
+            self.notify(f"Could not open {path}: {e}", severity="error", title="Large File")
+            return
+
+        self.stash_buffer()
+        if self.ta.swap_file is not None:
+            self.ta.swap_file.remove()
+            self.ta.swap_file = None
+        self.ta.load_document("", None)
+        self.saved_edit_count = self.ta.edit_count
+        self.filename = path
+        self.selected_directory = path.parent
+
+        self.ta.display = False
+        self.large_file.display = True
+        self.markdown.display = False
+        self.query_one("#title").display = False
+        self.query_one("#backlinks").display = False
+        self.configure_widths()
+
+        self.unsaved_changes = False
+        self.print_footer()
+        self.large_file.focus()
+        self.notify(f"{path.name} is opened read only.", title="Large File")
+
+    def close_large_file(self):
+        if self.large_file.mapped is None:
+            return
+        self.large_file.close()
+        self.large_file.display = False
+        self.ta.display = True
+
+    @on(LargeFileView.Indexed)
+    @on(LargeFileView.CursorMoved)
+    def large_file_indexed(self, event):
+        self.print_footer()
 
     def toggle_widget_display(self, id):
         widget = self.query_one(id)
@@ -1057,8 +4475,31 @@ class Noteri(App):
         else:
             widget.display = True
 
+        if id == "#timings":
+            self.show_timings(widget.display)
+
         self.configure_widths()
 
+    def show_timings(self, visible):
+        """Time the hot paths while the timings panel is shown, or while exporting them."""
+        SPANS.enabled = visible or SPANS.export is not None
+        if self.timings_timer is not None:
+            self.timings_timer.stop()
+            self.timings_timer = None
+        if visible:
+            self.print_timings()
+            self.timings_timer = self.set_interval(1.0, self.print_timings)
+
+    def print_timings(self):
+        rows = SPANS.percentiles()
+        if not rows:
+            self.query_one("#timings", expect_type=Static).update("No timings yet.")
+            return
+        lines = [f"{'span':<20}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for name, count, p50, p95, p99, longest in rows:
+            lines.append(f"{name:<20}{count:>7}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}{longest:>10.2f}")
+        self.query_one("#timings", expect_type=Static).update("\n".join(lines))
+
     def configure_widths(self):
 
         # if both enabled set width to 50%
@@ -1106,91 +4547,196 @@ class Noteri(App):
 
     @work(exclusive=True)
     async def refresh_directory_tree(self):
+        """Reload the whole tree from disk. Single changes go through `tree_changed` instead."""
 
         with self.expand_lock:
             self.allowed_to_expand = False
 
-        #self.dt.root.toggle_all()
-
-
         node = self.dt.cursor_node
-        line  = self.dt.cursor_line
-
-
-        await self.dt.reload_node(self.dt.root)
+        if node is not None and isinstance(node.data, PageEntry):
+            node = node.parent
+        cursor = node.data.path if node is not None and node.data is not None else None
 
-        #self.dt.root.toggle_all()
-
-        #node = self.dt.get_node_by_id(id)
-        node = self.dt.get_node_at_line(line)
-        
-        if node != None:
-            self.dt.select_node(node)
-        else:
-            self.notify(f"Could not find id {line}")
-            #self.notify(f"Child len {len(self.dt.children)}")
+        with self.profile("tree load"), SPANS.span("directory tree"):
+            await self.dt.reload_paths(self.dt.expanded_paths(), cursor)
 
         with self.expand_lock:
             self.allowed_to_expand = True
 
+    def tree_changed(self, kind, path, new_path=None):
+        """Apply one created, deleted or renamed path to the directory tree."""
+        with SPANS.span("directory tree"):
+            if kind == "created":
+                self.dt.add_path(path)
+            elif kind == "deleted":
+                self.dt.remove_path(path)
+            elif kind == "renamed":
+                self.dt.rename_path(path, new_path)
+
     def new_file(self, file_name):
         with open(file_name, "w") as f:
             f.write("")
-        self.refresh_directory_tree()
+        self.tree_changed("created", file_name)
         self.open_file(Path(file_name))
         self.notify(f"Created {file_name}", title="Created")
     
-    def save_file(self, new_filename=None):
+    def save_file(self, new_filename=None, quiet=False):
         if self.filename is None and new_filename is None:
             self.action_save_as()
             return
                 
         filename = self.filename if new_filename is None else new_filename
 
-        with open(filename, "w") as f:
-            f.write(self.ta.text)
-        self.notify(f"Saved {filename}", title="Saved")
-        self.filename = filename
-        
-        self.refresh_directory_tree()
+        if self.large_file.mapped is not None:
+            self.notify(f"{self.filename} is opened read only.", title="Large File", severity="warning")
+            return
+
+        text = self.ta.text
+        created = not os.path.exists(filename)
+        self.file_writer.write(filename, text, partial(self.call_from_thread, self.file_written, text, created, quiet))
+        self.undo_journal.append(self.ta.edit_history, filename, text)
+        if self.ta.swap_file is not None and self.ta.swap_file.path == os.path.abspath(filename):
+            self.ta.swap_file.reset(text)
+        else:
+            if self.ta.swap_file is not None:
+                self.ta.swap_file.remove()
+            self.ta.swap_file = SwapFile(self.directory, filename, text)
+        self.filename = Path(filename)
+        self.saved_edit_count = self.ta.edit_count
 
         self.unsaved_changes = False
-        self.unprinted_footer = True
-        self.unprinted_changes  = True
+        self.print_footer()
+
+    def offer_recovery(self):
+        """Ask about the swap files left by a crash, one at a time."""
+        if not self.orphaned_swaps:
+            return
+        swap_path, path = self.orphaned_swaps[0]
+        self.push_screen(YesNoPopup("Recover Unsaved Changes", self.recover_callback, message=f"Recover unsaved changes to {path} ?"))
+
+    def recover_callback(self, value):
+        swap_path, path = self.orphaned_swaps.pop(0)
+        text = None
+        if value:
+            try:
+                text = SwapFile.recover(swap_path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.notify(f"Could not recover {path}: {e}", severity="error", title="Recovery Failed")
+
+        with contextlib.suppress(OSError):
+            os.remove(swap_path)
+
+        if text is None:
+            self.offer_recovery()
+        elif self.unsaved_changes:
+            self.action_stack.insert(0, partial(self.show_recovered, Path(path), text))
+            self.push_screen(YesNoPopup("Unsaved Changes",  self.unsaved_changes_callback, message=f"Save Changes to {self.filename} ?"))
+        else:
+            self.show_recovered(Path(path), text)
+
+    def show_recovered(self, path:Path, text:str):
+        """Show the text recovered from a swap file as unsaved changes to `path`."""
+        self.opening = path
+        self.file_read(path, text)
+        # the recovered text is not on disk, so it is never kept as a cached buffer
+        self.saved_edit_count = -1
+        # the recovered text is not on disk, so keep all of it in the new swap file
+        with contextlib.suppress(OSError):
+            self.ta.swap_file.compact(text)
+        self.unsaved_changes = True
+        self.print_footer()
+
+        self.offer_recovery()
+
+    def file_written(self, text, created, quiet, path, error):
+        """Called once the background writer has a saved file on disk, or failed to."""
+        if error is None and self.filename is not None and os.path.abspath(self.filename) == path:
+            self.disk_stat = self.file_stat(path)
+        buffer = self.buffers.get(path)
+        if buffer is not None and error is None:
+            buffer.stat = self.file_stat(path)
+        elif buffer is not None:
+            self.buffers.take(path)
+
+        if error is not None:
+            self.notify(f"Could not save {path}: {error}", severity="error", title="Save Failed")
+            if self.filename is not None and os.path.abspath(self.filename) == path:
+                self.unsaved_changes = True
+                self.print_footer()
+            return
+
+        if not quiet:
+            self.notify(f"Saved {path}", title="Saved")
+        if path.endswith(".md"):
+            self.backlink_index.update_file(path, text)
+        self.fulltext_index.update_file(path, text)
+        if created:
+            self.tree_changed("created", path)
+
+    def schedule_autosave(self):
+        if self.autosave_timer is not None:
+            self.autosave_timer.stop()
+        self.autosave_timer = self.set_timer(self.autosave, self.autosave_file)
+
+    def autosave_file(self):
+        if self.unsaved_changes and self.filename is not None and self.opening is None:
+            self.save_file(quiet=True)
 
     def delete_file(self):
-        if self.dt.cursor_node.data.path.is_dir():
-            shutil.rmtree(self.dt.cursor_node.data.path)
+        path = self.dt.cursor_path()
+        if path is None:
+            return
+        if path.is_dir():
+            import shutil
+            shutil.rmtree(path)
         else:
-            os.remove(self.dt.cursor_node.data.path)
-        self.notify(f"Deleted {self.dt.cursor_node.data.path}", title="Deleted")
-        self.refresh_directory_tree()
+            os.remove(path)
+        self.backlink_index.remove_file(path)
+        self.fulltext_index.remove_file(path)
+        self.notify(f"Deleted {path}", title="Deleted")
+        self.tree_changed("deleted", path)
 
     def new_directory(self, directory_name):
         os.mkdir(directory_name)
-        self.refresh_directory_tree()
+        self.tree_changed("created", directory_name)
         self.notify(f"Created {directory_name}", title="Created")
 
     def rename_file(self, new_filename):
-        path = self.dt.cursor_node.data.path
-        if new_filename == path:
+        path = self.dt.cursor_path()
+        if path is None or new_filename == path:
             return
 
         if path.is_dir():
             # move directory
             os.rename(str(path), new_filename)
-            self.dt.watch_path()
+            self.backlink_index.remove_file(path)
+            self.backlink_index.ready = False
+            self.update_backlinks()
+            self.fulltext_index.remove_file(path)
+            self.build_fulltext_index()
+            self.tree_changed("renamed", path, new_filename)
+        elif path.is_file() and self.large_file.mapped is not None:
+            # large files are never written back, so move them instead
+            os.rename(str(self.filename), new_filename)
+            self.backlink_index.remove_file(self.filename)
+            self.fulltext_index.remove_file(self.filename)
+            self.tree_changed("renamed", self.filename, new_filename)
+            self.filename = Path(new_filename)
+            self.print_footer()
         elif path.is_file():
             tmp = self.filename
+            # move the saved file first, so a failed write of the buffer never loses the note
+            self.file_writer.wait(tmp)
+            os.rename(str(tmp), new_filename)
             self.save_file(new_filename)
-            os.remove(tmp)
-            self.dt.watch_path()
+            self.backlink_index.remove_file(tmp)
+            self.fulltext_index.remove_file(tmp)
+            self.tree_changed("renamed", tmp, new_filename)
         return
         
     def create_table(self, rows, columns):
-        self.add_history()
+        self.ta.edit_history.checkpoint()
         
-        self.history_counter
         insert_text = ""
 
         insert_text += f"|   {'|   '.join([''] * columns)}|\n"
@@ -1262,15 +4808,21 @@ class Noteri(App):
         self.push_screen(InputPopup(self.save_file, title="Save As", validators=[Length(minimum=1)]))
 
     def action_rename(self):
-        path = self.dt.cursor_node.data.path
+        path = self.dt.cursor_path()
+        if path is None:
+            return
         self.push_screen(InputPopup(self.rename_file, title="Rename", validators=[Length(minimum=1)], default=str(path)))
     
     def action_delete(self):
-        self.push_screen(YesNoPopup(f"Delete {self.dt.cursor_node.data.path}", self.delete_file_callback))
+        path = self.dt.cursor_path()
+        if path is None:
+            return
+        self.push_screen(YesNoPopup(f"Delete {path}", self.delete_file_callback))
     
     def action_copy(self):
         
         self.clipboard = self.ta.selected_text
+        import pyperclip
         pyperclip.copy(self.clipboard)
         self.notify(f"{self.clipboard}", title="Copied")
 
@@ -1281,6 +4833,7 @@ class Noteri(App):
         
     def action_paste(self):
         
+        import pyperclip
         self.ta.replace(pyperclip.paste(), self.ta.selection.start, self.ta.selection.end)
 
     def action_table(self):
@@ -1314,7 +4867,7 @@ class Noteri(App):
 
 
     def action_table_of_contents(self):
-        self.ta.replace(self.generate_table_of_contents(self.markdown._table_of_contents), self.ta.selection.start, self.ta.selection.end, maintain_selection_offset=False)
+        self.ta.replace(self.generate_table_of_contents(self.markdown.table_of_contents(self.ta.text)), self.ta.selection.start, self.ta.selection.end, maintain_selection_offset=False)
         # get all links
     
     def action_directory_table_of_contents(self):
@@ -1398,111 +4951,144 @@ class Noteri(App):
         self.ta.replace(f"{'#' * level} {self.ta.selected_text}", self.ta.selection.start, self.ta.selection.end, maintain_selection_offset=False)
 
     def action_find(self):
-        self.app.push_screen(InputPopup(self.find_text, title="Find", validators=[Length(minimum=1)], default=self.last_find))
-        pass
+        self.app.push_screen(FindPopup(self.last_find, self.last_replace, self.find_regex, self.find_case_sensitive))
+
+    def action_goto_line(self):
+        self.push_screen(InputPopup(self.goto_line, title="Go to Line", validators=[Integer(minimum=1)]))
+
+    def goto_line(self, line):
+        row = int(line) - 1
+        if self.large_file.mapped is not None:
+            self.large_file.goto_line(row)
+            self.large_file.focus()
+            self.print_footer()
+        else:
+            self.ta.move_cursor((min(row, self.ta.document.line_count - 1), 0), center=True)
+            self.ta.focus()
+
+    def action_find_next(self):
+        self.find_next()
+
+    def action_find_previous(self):
+        self.find_next(forward=False)
     
+    def action_search_vault(self):
+        self.push_screen(VaultSearchPopup(self.open_file_at, self.fulltext_index, self.directory))
+
+    def open_file_at(self, path, line):
+        self.open_file(path, cursor=(line, 0))
+
     def action_strikethrough(self):
         self.ta.replace(f"~~{self.ta.selected_text}~~", self.ta.selection.start, self.ta.selection.end, maintain_selection_offset=False)
 
     def find_text(self, search_text):
+        self.set_find(search_text, self.find_regex, self.find_case_sensitive)
+        self.find_next()
+
+    def set_find(self, query, regex=False, case_sensitive=False):
+        """Compile the find query and return a description of its matches."""
+        self.last_find = query
+        self.find_regex = regex
+        self.find_case_sensitive = case_sensitive
+        if not query:
+            self.ta.find_index.pattern = None
+            self.ta.find_index.clear()
+            return ""
 
-        self.last_find = search_text
-        
-        cursor_location = self.ta.cursor_location
-
-        # calculate the string index from a row collumn on newlines.
-        
-        text = self.ta.text
-        split_lines = text.split("\n")
-
-        #calculate lenths of each line and stop before greater than selection row
-        col = -1
-        row = -1
-        tmp_find_col = -1
-        split_lines[cursor_location[0]] = split_lines[cursor_location[0]][cursor_location[1] + 1:]
-        for i, line in enumerate(split_lines[cursor_location[0]:]):
-            tmp_find_col = line.find(search_text)
-            if tmp_find_col != -1:
-                if i == 0:
-                    tmp_find_col += cursor_location[1] + 1
-                col = tmp_find_col
-                break
-        row = i + cursor_location[0]
-
-        if col == -1:
-            self.notify(f"Reached bottom of doc searching for {search_text}.")
-            return
-
-        else:
-            self.ta.move_cursor((row, col))
-            self.ta.move_cursor_relative(columns=len(search_text), select=True)
+        try:
+            self.ta.find_index.compile(query, regex, case_sensitive)
+        except re.error as e:
+            self.ta.find_index.pattern = None
+            self.ta.find_index.clear()
+            return f"Invalid pattern: {e}"
+        return self.find_status()
+
+    def find_status(self, start=None):
+        index = self.ta.find_index
+        index.build(self.ta.document)
+        if index.pattern is None:
+            return ""
+        if not index.count:
+            return "No matches"
+        position = index.position(start) if start is not None else 0
+        if position:
+            return f"{position} of {index.count} matches"
+        return f"{index.count} matches"
+
+    def find_next(self, forward=True):
+        """Select the next (or previous) match of the find query, wrapping around the document."""
+        index = self.ta.find_index
+        if index.pattern is None:
+            if self.last_find:
+                self.set_find(self.last_find, self.find_regex, self.find_case_sensitive)
+            if index.pattern is None:
+                return ""
+        index.build(self.ta.document)
+
+        start, end = sorted(self.ta.selection)
+        match = index.find(end if forward else start, forward)
+        if match is None:
+            self.notify(f"Could not find {self.last_find}")
+            return "No matches"
+
+        start, end, wrapped = match
+        if wrapped:
+            self.notify(f"Reached {'bottom' if forward else 'top'} of doc, continuing from the {'top' if forward else 'bottom'}.")
+        self.ta.selection = Selection(start, end)
+        self.ta.scroll_cursor_visible(center=True)
+        return self.find_status(start)
+
+    def replace_next(self, replacement):
+        """Replace the selected match, then select the next one."""
+        index = self.ta.find_index
+        index.build(self.ta.document)
+        start, end = sorted(self.ta.selection)
+        if index.pattern is not None and start[0] == end[0] and (start[1], end[1]) in index.lines[start[0]]:
+            try:
+                text = index.expand(self.ta.document, start, end, replacement)
+            except re.error as e:
+                self.notify(f"Invalid replacement: {e}", severity="error")
+                return self.find_status(start)
+            if text is None:
+                return self.find_next()
+            self.ta.edit_history.checkpoint()
+            self.ta.replace(text, start, end, maintain_selection_offset=False)
+            self.ta.edit_history.checkpoint()
+        return self.find_next()
+
+    def replace_all(self, replacement):
+        """Replace every match with one edit, so it is undone in one step."""
+        index = self.ta.find_index
+        index.build(self.ta.document)
+        if index.pattern is None:
+            return ""
+        try:
+            replaced = index.replace_all(self.ta.document, replacement)
+        except re.error as e:
+            self.notify(f"Invalid replacement: {e}", severity="error")
+            return self.find_status()
+        if replaced is None:
+            return "No matches"
+
+        text, start, end, count = replaced
+        self.ta.edit_history.checkpoint()
+        self.ta.replace(text, start, end, maintain_selection_offset=False)
+        self.ta.edit_history.checkpoint()
+        self.notify(f"Replaced {count} matches", title="Replace All")
+        return self.find_status()
 
     def action_copy_link(self):
         
         #put link into clipboard
         text = f"[{self.filename.name}]({self.filename})"
+        import pyperclip
         pyperclip.copy(self.ta.selected_text)
 
-    def add_history(self):
-        if self.history_disabled:
-            return
-
-        ta = self.query_one("TextArea", TextArea)
-        if self.history_index < len(self.history) - 1:
-            self.history[self.history_index] = { "text": self.ta.text, 
-                                                 "cursor_location": self.ta.cursor_location,
-                                                 "scroll_location": (self.ta.scroll_x, self.ta.scroll_y)}
-            #remove forward history
-            self.history = self.history[:self.history_index + 1]
-            #self.notify("Remove forward history")
-        else:
-            if len(self.history) > 0:
-                if  self.history[-1]["text"] == self.ta.text:
-                    return
-                #self.notify("Replace history")
-            self.history.append({ "text": self.ta.text, 
-                                  "cursor_location": self.ta.cursor_location,
-                                  "scroll_location": (self.ta.scroll_x, self.ta.scroll_y)})
-
-        self.history_index += 1
-        self.history_counter = 0
-        #self.notify(f"add history. {self.history_index} {len(self.history)}")
-
-        # make self.history only latest 10
-        if len(self.history) > 10:
-            self.history = self.history[-10:]
-            self.history_index = 9
-
     def action_undo(self):
-        
-        #self.notify(f"Index: {self.history_index} Len History: {len(self.history)}")
-
-        if self.history_index > 0:
-            if self.history_index == len(self.history) -1:
-              self.add_history()
-            self.history_index -= 1
-            self.history_disabled = True
-            self.ta.load_text(self.history[self.history_index]["text"])
-            self.ta.cursor_location = self.history[self.history_index]["cursor_location"]
-            self.ta.scroll_to(self.history[self.history_index]["scroll_location"][0], self.history[self.history_index]["scroll_location"][1], animate=False)
-            self.history_counter = -1
-        
-            self.history_disabled = False
-
-            if self.history_index == 0 and len(self.history) == 0:
-                self.add_history()
+        self.ta.undo()
 
     def action_redo(self):
-        
-
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.history_disabled = True
-            self.ta.load_text(self.history[self.history_index]["text"])
-            self.ta.cursor_location = self.history[self.history_index]["cursor_location"]
-            self.ta.scroll_to(self.history[self.history_index]["scroll_location"][0], self.history[self.history_index]["scroll_location"][1], animate=False)
-            self.history_counter = -1
-        self.history_disabled = False
+        self.ta.redo()
 
     def action_exit(self):
         if self.unsaved_changes:
@@ -1552,10 +5138,23 @@ class Noteri(App):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("path", default="./", nargs='?', help="Path to file or directory to open")
+    parser.add_argument("--undo-depth", type=int, default=1000, help="Number of undo steps to keep")
+    parser.add_argument("--undo-memory", type=int, default=32, help="Memory budget for undo history in MB")
+    parser.add_argument("--large-file-size", type=int, default=50, help="Open files above this size in MB read only, without highlighting or preview")
+    parser.add_argument("--autosave", type=float, default=0, help="Save changes after this many idle seconds, 0 to disable")
+    parser.add_argument("--profile-startup", action="store_true", help="Print how long each startup phase took on exit")
+    parser.add_argument("--timings", help="Append the timing of every instrumented span to this JSON lines file")
+    parser.add_argument("--buffer-memory", type=int, default=64, help="Megabytes of recently shown files to keep parsed in memory")
     args = parser.parse_args()
 
-    app = Noteri(args.path)
+    directory = args.path if os.path.isdir(args.path) else "./"
+    orphans = SwapFile.find_orphans(directory)
+
+    app = Noteri(args.path, undo_depth=args.undo_depth, undo_memory=args.undo_memory, large_file_size=args.large_file_size, autosave=args.autosave, recover=orphans, profile_startup=args.profile_startup, timings=args.timings, buffer_memory=args.buffer_memory)
     app.run()
 
+    if app.startup_profile is not None:
+        print(app.startup_profile.report(), file=sys.stderr)
+
 if __name__ == "__main__":
     main()
@@ -7,7 +7,7 @@ setup(
     description='A short description of your project',
     long_description=open('README.md').read(),
     install_requires=[
-        'textual>=0.40',
+        'textual==0.48.2',
     ],
     python_requires='>=3.7',
     entry_points={